@@ -0,0 +1,148 @@
+"""End-to-end throughput and memory benchmark of the DQN training pipeline in `experiments/train.py`.
+
+Runs a short training job with a fixed seed for every combination of the given settings and reports:
+    env frames/s: environment steps per second spent collecting rollouts, including action prediction.
+    grad steps/s: gradient steps per second spent training.
+    peak RSS: maximum resident set size of the process running the job.
+    replay bytes/transition: memory allocated by the replay buffer per stored transition.
+
+Each configuration runs in a fresh process, so that peak RSS is measured independently. The off-policy algorithms of
+stable-baselines3 0.11 only collect rollouts from a single environment, so `--n-envs` only accepts 1 for now. Example:
+
+    $ python -m experiments.benchmark --formats flat grid --dtypes float32 float64 --self-play off on \
+        --replay standard compact
+"""
+import argparse
+import itertools
+import os
+import resource
+import tempfile
+import time
+import traceback
+from multiprocessing import get_context
+
+import numpy as np
+from omegaconf import OmegaConf
+from stable_baselines3 import DQN
+from stable_baselines3.common.callbacks import BaseCallback, EveryNTimesteps
+from stable_baselines3.dqn import MlpPolicy
+
+from experiments.train import get_env, SelfPlay, TensorboardCallback, use_compact_replay_buffer
+from gym_env.util.io import load_hydra_config
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'config.yaml')
+
+
+def run_benchmark(setting, args):
+    """Train a DQN agent for a fixed number of steps and measure its throughput.
+
+    :param setting: dict with the keys 'n_envs', 'format', 'dtype', 'self_play' and 'replay'.
+    :param args: parsed command line arguments.
+    :return: dict of measurements.
+    """
+    assert setting['n_envs'] == 1, 'DQN of stable-baselines3 0.11 only supports a single environment.'
+    cfg = load_hydra_config(args.config)
+    # composed configs are in struct mode, which rejects keys that the yaml files leave at the env's defaults
+    OmegaConf.set_struct(cfg, False)
+    env_conf = OmegaConf.merge(cfg.env, {'flat_observations': setting['format'] == 'flat',
+                                         'observation_dtype': setting['dtype']})
+    model_conf = OmegaConf.merge(cfg.model, {'buffer_size': args.buffer_size, 'learning_starts': args.learning_starts})
+
+    env = get_env(None, env_conf, setting['n_envs'])
+    model = DQN(MlpPolicy, env, **model_conf)
+    if setting['replay'] == 'compact':
+        use_compact_replay_buffer(model)
+
+    timer = PhaseTimer()
+    callbacks = [timer, TensorboardCallback()]
+    with tempfile.TemporaryDirectory() as ckpt_dir:
+        if setting['self_play']:
+            callbacks.append(EveryNTimesteps(args.n_update_selfplay, callback=SelfPlay(ckpt_dir)))
+        start = time.perf_counter()
+        model.learn(total_timesteps=args.steps, callback=callbacks)
+        total_time = time.perf_counter() - start
+
+    train_time = total_time - timer.rollout_time
+    buffer_bytes = sum(value.nbytes for value in vars(model.replay_buffer).values() if isinstance(value, np.ndarray))
+    n_buffer_transitions = model.replay_buffer.buffer_size * model.replay_buffer.n_envs
+    return {'env frames/s': model.num_timesteps / timer.rollout_time,
+            'grad steps/s': model._n_updates / train_time if train_time > 0 else float('nan'),
+            # ru_maxrss is given in kilobytes on linux
+            'peak RSS (MB)': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'replay bytes/transition': buffer_bytes / n_buffer_transitions}
+
+
+class PhaseTimer(BaseCallback):
+    """
+    Callback measuring the time spent collecting rollouts, the rest of `learn()` is spent training.
+    """
+
+    def __init__(self, verbose=0):
+        super(PhaseTimer, self).__init__(verbose)
+        self.rollout_time = 0.0
+        self._rollout_start = None
+
+    def _on_rollout_start(self) -> None:
+        self._rollout_start = time.perf_counter()
+
+    def _on_rollout_end(self) -> None:
+        self.rollout_time += time.perf_counter() - self._rollout_start
+
+    def _on_step(self) -> bool:
+        return True
+
+
+def _run_in_process(setting, args, result_sender):
+    """Entry point of the benchmark processes, sends back the measurements or the reason of failure.
+    """
+    try:
+        result_sender.send(run_benchmark(setting, args))
+    except Exception:
+        result_sender.send(traceback.format_exc(limit=1).strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=CONFIG_PATH, help='hydra config of the training job.')
+    parser.add_argument('--n-envs', type=int, nargs='+', default=[1],
+                        help='numbers of parallel envs, DQN of stable-baselines3 0.11 only supports 1.')
+    parser.add_argument('--formats', nargs='+', choices=['flat', 'grid'], default=['flat'])
+    parser.add_argument('--dtypes', nargs='+', default=['float32', 'float64'])
+    parser.add_argument('--self-play', nargs='+', choices=['off', 'on'], default=['off'])
+    parser.add_argument('--replay', nargs='+', choices=['standard', 'compact'], default=['standard'])
+    parser.add_argument('--steps', type=int, default=20000, help='number of environment steps per job.')
+    parser.add_argument('--learning-starts', type=int, default=1000)
+    parser.add_argument('--buffer-size', type=int, default=1000000)
+    parser.add_argument('--n-update-selfplay', type=int, default=5000)
+    args = parser.parse_args()
+    args.config = os.path.abspath(args.config)
+    assert set(args.n_envs) == {1}, 'DQN of stable-baselines3 0.11 only supports a single environment.'
+
+    context = get_context('spawn')
+    header = ['n_envs', 'format', 'dtype', 'self_play', 'replay', 'env frames/s', 'grad steps/s', 'peak RSS (MB)',
+              'replay bytes/transition']
+    print(' | '.join(header))
+    for n_envs, formatting, dtype, self_play, replay in itertools.product(args.n_envs, args.formats, args.dtypes,
+                                                                          args.self_play, args.replay):
+        setting = {'n_envs': n_envs, 'format': formatting, 'dtype': dtype, 'self_play': self_play == 'on',
+                   'replay': replay}
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_in_process, args=(setting, args, sender))
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = 'benchmark process died'
+        process.join()
+
+        row = [str(n_envs), formatting, dtype, self_play, replay]
+        if isinstance(result, dict):
+            row += [f'{result[key]:.1f}' for key in header[5:]]
+        else:
+            row.append(f'failed: {result}')
+        print(' | '.join(row), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""Export a trained DQN checkpoint into a weights file for the torch-free `NumpyMlpPolicy`. Example:
+
+    $ python -m experiments.export_policy ckpts/rl_model_5000000_steps.zip ckpts/policy.npz
+"""
+import argparse
+
+from stable_baselines3 import DQN
+
+from gym_env.numpy_policy import export_dqn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help='path to the DQN checkpoint saved by stable baselines.')
+    parser.add_argument('output', help='path of the .npz file to write.')
+    args = parser.parse_args()
+
+    export_dqn(DQN.load(args.checkpoint), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import os
 
 import hydra
+import numpy as np
 from omegaconf import DictConfig
 from stable_baselines3 import DQN
 from stable_baselines3.common.callbacks import BaseCallback, EveryNTimesteps, CheckpointCallback
@@ -8,67 +9,82 @@ from stable_baselines3.common.env_util import make_vec_env
 from stable_baselines3.dqn import MlpPolicy
 
 from gym_env.env import Expando
+from gym_env.replay_buffer import ExpandoReplayBuffer
+from gym_env.util.vec_env import reconfigure_vec_env
 
 
-def get_env(op_policies, conf):
+def get_env(op_policies, conf, n_envs=1):
     env = make_vec_env(Expando,
                        env_kwargs=dict(**conf,
                                        policies_other=op_policies),
-                       n_envs=1)
+                       n_envs=n_envs,
+                       monitor_kwargs=dict(info_keywords=('episode_stats',)))
     env.reset()
     return env
 
 
+def use_compact_replay_buffer(model):
+    """Replace the model's replay buffer by an ExpandoReplayBuffer, which stores board states as categorical codes.
+    """
+    model.replay_buffer = ExpandoReplayBuffer(model.buffer_size, model.observation_space, model.action_space,
+                                              model.device)
+
+
 class TensorboardCallback(BaseCallback):
     """
-    Custom callback for plotting additional values in tensorboard.
+    Custom callback for plotting additional values in tensorboard. Logs running means of the episode statistics that
+    each env reports at the end of an episode, collected by the Monitor wrapper into the model's episode info buffer.
     """
 
     def __init__(self, verbose=0):
         super(TensorboardCallback, self).__init__(verbose)
 
     def _on_step(self) -> bool:
-        # Log scalar value (here a random variable)
         return True
 
     def _on_rollout_end(self) -> None:
-        self.init_callback(self.model)
-        game = self.training_env.get_attr('game', indices=0)[0]
-        player = game.players[0]
-        self.logger.record('rollout/happiness', player.happiness_penalty)
-        self.logger.record('rollout/room', player.room)
-        self.logger.record('rollout/population', player.population)
-        self.logger.record('rollout/total_reward', player.total_reward)
+        episode_stats = [ep_info['episode_stats'] for ep_info in self.model.ep_info_buffer
+                         if 'episode_stats' in ep_info]
+        if not episode_stats:
+            return
+
+        for key in episode_stats[0]:
+            self.logger.record(f'rollout/{key}', np.mean([stats[key] for stats in episode_stats]))
 
 
 class SelfPlay(BaseCallback):
-    def __init__(self, checkpoint_path, env_conf):
+    """
+    Replaces the opponents by a snapshot of the current policy. The envs are reconfigured in place and switch to the
+    new opponent at the start of their next episode.
+    """
+
+    def __init__(self, checkpoint_path):
         super().__init__()
         self.checkpoint_path = checkpoint_path
-        self.env_conf = env_conf
 
     def _on_step(self) -> bool:
         ckpt_path = os.path.join(self.checkpoint_path, f'timestep_{self.num_timesteps}')
         self.model.save(ckpt_path)
         saved_policy = self.model.__class__.load(ckpt_path)
-        env = get_env([saved_policy], self.env_conf)
-        self.model.set_env(env)
-        self.init_callback(self.model)
+        reconfigure_vec_env(self.model.get_env(), policies_other=[saved_policy])
         return True
 
 
 @hydra.main(config_path='config/', config_name='config')
 def main(cfg: DictConfig):
-    env = get_env(None, cfg.env)
+    assert cfg.n_envs == 1, 'DQN of stable-baselines3 0.11 only supports a single environment.'
+    env = get_env(None, cfg.env, cfg.n_envs)
     model = DQN(MlpPolicy,
                 env,
                 **cfg.model,
                 tensorboard_log='logs/',
                 verbose=1)
+    if cfg.compact_replay_buffer:
+        use_compact_replay_buffer(model)
 
     callbacks = [TensorboardCallback()]
     if cfg.self_play:
-        self_play = EveryNTimesteps(cfg.n_update_selfplay, callback=SelfPlay('ckpts/', cfg.env))
+        self_play = EveryNTimesteps(cfg.n_update_selfplay, callback=SelfPlay('ckpts/'))
         callbacks.append(self_play)
     if cfg.ckpt_freq:
         ckpt_cb = CheckpointCallback(save_freq=cfg.ckpt_freq, save_path='ckpts/')
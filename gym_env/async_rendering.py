@@ -0,0 +1,157 @@
+import time
+from copy import copy
+from multiprocessing import get_context
+from queue import Empty, Full
+
+import numpy as np
+
+
+class AsyncGameRenderer:
+    """Renders a game in a separate process, so that rendering never blocks the process stepping the game.
+
+    Every call to `step()` publishes a compact snapshot of the game, at most `fps` times per second. A snapshot only
+    holds what is drawn: the board's codes, the cursors, each player's scores and the pieces that do not generate reward
+    yet. The render process draws it with the piece prototypes, which are sent once when it is started. It always draws
+    the most recent snapshot: snapshots are passed through a queue holding a single frame, and a frame that has not
+    been picked up yet is replaced by the newer one. Between snapshots, the render process keeps the window responsive
+    by redrawing the last one. pyglet is only imported in the render process.
+    """
+
+    def __init__(self, game, cell_size=50, padding=10, ui_font_size=12, fps=30):
+        """
+
+        :param game: the game to render.
+        :param cell_size: the length of each square in pixels.
+        :param padding: the padding between cells in pixels.
+        :param ui_font_size: size of the font, used to show player statistics.
+        :param fps: maximum number of snapshots published per second.
+        """
+        assert len(game.grid_size) == 2, 'only 2d grids can be rendered at the moment'
+        self.game = game
+        self.fps = fps
+        self._last_publish = None
+
+        layout = (tuple(game.grid_size), game.n_players, tuple(game._id_to_piece.values()))
+        context = get_context('spawn')
+        self._frames = context.Queue(maxsize=1)
+        self._process = context.Process(target=_render_loop,
+                                        args=(self._frames, layout, cell_size, padding, ui_font_size, fps), daemon=True)
+        self._process.start()
+
+    def step(self):
+        """Publish a snapshot of the game's current state, unless the last one was published less than 1 / fps seconds
+        ago.
+        """
+        now = time.perf_counter()
+        if self._last_publish is not None and now - self._last_publish < 1 / self.fps:
+            return
+        self._last_publish = now
+        self._publish(self._snapshot())
+
+    def close(self):
+        """Stop the render process.
+        """
+        if self._process is not None:
+            self._publish(None)
+            self._process.join(timeout=1)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def _snapshot(self):
+        """Copy the state that is drawn, since the game keeps changing while the queue's feeder thread sends the frame.
+
+        :return: tuple of the board's codes, the cursors, the scores of each player, see `GameRenderer.draw_scores()`,
+        and the positions of pieces that do not generate reward yet.
+        """
+        game = self.game
+        players = game.players
+        # the scores are computed first, like the synchronous renderer does, since they may update the pieces' states
+        scores = np.array([(p.population, p.room, p.happiness_penalty, p.current_reward, p.total_reward)
+                           for p in players], dtype=np.float64)
+        cursors = np.array([p.cursor for p in players], dtype=np.int64)
+        inactive = [position for position, piece in game.board.grid.items()
+                    if not getattr(piece, 'generates_reward', True)]
+        return game.board.dense_codes().copy(), cursors, scores, inactive
+
+    def _publish(self, frame):
+        """Put a frame into the queue, dropping the previous frame if the render process has not picked it up yet.
+        """
+        try:
+            self._frames.get_nowait()
+        except Empty:
+            pass
+        try:
+            self._frames.put_nowait(frame)
+        except Full:
+            pass
+
+
+class _PlayerView:
+    """Read-only stand-in of a player in the render process, with the attributes drawn by `GameRenderer`.
+    """
+
+    def __init__(self, player_id):
+        self.player_id = player_id
+        self.cursor = None
+        self.population = self.room = self.happiness_penalty = self.current_reward = self.total_reward = 0
+
+
+class _GameView:
+    """Read-only stand-in of a game and its board in the render process, updated from the published snapshots.
+    """
+
+    def __init__(self, grid_size, n_players, prototypes):
+        self.grid_size = grid_size
+        self.n_players = n_players
+        self.players = [_PlayerView(i) for i in range(n_players)]
+        self.board = self
+        self.codes = None
+        self.inactive = set()
+
+        # a piece per code, and per code an inactive variant of the pieces that generate reward eventually
+        n_piece_types = len(prototypes) - 1
+        self._pieces = {(0, False): prototypes[0]}
+        for code in range(1, 1 + n_players * n_piece_types):
+            player_id, piece_id = divmod(code - 1, n_piece_types)
+            for inactive in (False, True):
+                piece = copy(prototypes[piece_id + 1])
+                piece.player = self.players[player_id]
+                if hasattr(piece, 'generates_reward'):
+                    piece.generates_reward = not inactive
+                self._pieces[code, inactive] = piece
+
+    def update(self, snapshot):
+        self.codes, cursors, scores, inactive = snapshot
+        self.inactive = set(inactive)
+        for player, cursor, player_scores in zip(self.players, cursors, scores.tolist()):
+            player.cursor = cursor
+            (player.population, player.room, player.happiness_penalty, player.current_reward,
+             player.total_reward) = player_scores
+
+    def get_piece(self, coordinates):
+        code = int(self.codes[coordinates])
+        return self._pieces[code, code != 0 and coordinates in self.inactive]
+
+
+def _render_loop(frames, layout, cell_size, padding, ui_font_size, fps):
+    """Main loop of the render process.
+    """
+    from gym_env.rendering import GameRenderer
+
+    game = _GameView(*layout)
+    renderer = None
+    while True:
+        try:
+            frame = frames.get(timeout=1 / fps)
+        except Empty:
+            frame = False
+
+        if frame is None:
+            break
+        if frame:
+            game.update(frame)
+            if renderer is None:
+                renderer = GameRenderer(game, cell_size, padding, ui_font_size)
+        if renderer is not None:
+            renderer.step()
@@ -0,0 +1,177 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from gym_env.game.encoding import build_observations, perspective_permutation
+
+TransitionBatch = namedtuple('TransitionBatch', ['observations', 'actions', 'rewards', 'next_observations', 'dones'])
+
+
+class ExpandoDataset:
+    """Reads episodes recorded by `ExpandoRecorder`. All arrays are opened memory-mapped, so only the rows that are
+    accessed are read from disk. Observations are rebuilt from the stored board codes on demand and for whole batches
+    at once.
+    """
+
+    _fields = ('codes', 'cursors', 'scalars', 'actions', 'rewards', 'dones')
+    # fields that recordings of older versions do not contain
+    _optional_fields = ('hashes',)
+
+    def __init__(self, directory, formatting=None, dtype=np.float64, seed=None):
+        """
+
+        :param directory: directory of a recording.
+        :param formatting: 'flat' or 'grid' observation format. Defaults to the format used during recording.
+        :param dtype: dtype of the rebuilt observations.
+        :param seed: seed for sampling batches.
+        """
+        with open(os.path.join(directory, 'meta.json')) as fp:
+            self.meta = json.load(fp)
+
+        self.directory = directory
+        self.formatting = formatting or self.meta['observation_format']
+        self.dtype = dtype
+        self.np_random = np.random.default_rng(seed)
+
+        self.grid_size = tuple(self.meta['grid_size'])
+        self.n_players = self.meta['n_players']
+        self.one_hot_dim = self.meta['one_hot_dim']
+        self.chunk_size = self.meta['chunk_size']
+        self.n_rows = self.meta['n_rows']
+        self.episodes = np.load(os.path.join(directory, 'episodes.npy'))
+        self._any_transition = None
+
+        n_chunks = -(-self.n_rows // self.chunk_size)
+        self._chunks = [self._open_chunk(i) for i in range(n_chunks)]
+        self._permutations = [perspective_permutation(i, self.n_players, len(self.meta['piece_types']) - 1)
+                              for i in range(self.n_players)]
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def n_episodes(self):
+        return len(self.episodes)
+
+    def get_rows(self, rows, fields=_fields):
+        """Gather rows from the memory-mapped chunks.
+
+        :param rows: integer array of row indices.
+        :param fields: names of the arrays to gather.
+        :return: dict mapping each field to an array with the rows in the order given.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        # read each chunk with sorted indices to keep disk access sequential
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        chunk_ids, offsets = np.divmod(sorted_rows, self.chunk_size)
+        bounds = np.flatnonzero(np.diff(chunk_ids)) + 1
+
+        out = {}
+        for name in fields:
+            parts = [self._chunks[ids[0]][name][offs]
+                     for ids, offs in zip(np.split(chunk_ids, bounds), np.split(offsets, bounds)) if len(ids)]
+            gathered = np.concatenate(parts) if parts else self._chunks[0][name][:0]
+            out[name] = np.empty_like(gathered)
+            out[name][order] = gathered
+        return out
+
+    def get_observations(self, rows, player_id=0):
+        """Rebuild observations of a player for the given rows.
+
+        :param rows: integer array of row indices.
+        :param player_id: the player from whose perspective the board is observed.
+        :return: batch of observations in the dataset's format.
+        """
+        data = self.get_rows(rows, ('codes', 'cursors', 'scalars'))
+        return self._build_observations(data, player_id)
+
+    def get_episode(self, episode_id, player_id=0):
+        """Load a whole episode.
+
+        :param episode_id: index of the episode.
+        :param player_id: the player from whose perspective the board is observed.
+        :return: a TransitionBatch containing all transitions of the episode.
+        """
+        start, length = self.episodes[episode_id]
+        return self.get_transitions(np.arange(start, start + length), player_id)
+
+    def get_transitions(self, rows, player_id=0):
+        """Load transitions. The next observation of a transition that ended an episode is its own observation, since
+        the terminal state isn't recorded.
+
+        :param rows: integer array of row indices.
+        :param player_id: the player from whose perspective the board is observed.
+        :return: a TransitionBatch.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        data = self.get_rows(rows)
+        next_rows = np.where(data['dones'], rows, rows + 1)
+        next_data = self.get_rows(next_rows, ('codes', 'cursors', 'scalars'))
+
+        return TransitionBatch(self._build_observations(data, player_id),
+                               data['actions'],
+                               data['rewards'],
+                               self._build_observations(next_data, player_id),
+                               data['dones'])
+
+    def sample(self, batch_size, player_id=0):
+        """Sample a batch of transitions uniformly.
+
+        :param batch_size: number of transitions to sample.
+        :param player_id: the player from whose perspective the board is observed.
+        :return: a TransitionBatch.
+        :raises ValueError: if the next state of no row is known, e.g. if all episodes are single interrupted rows.
+        """
+        if not self._has_transitions:
+            raise ValueError('the dataset contains no transition with a known next state.')
+        rows = np.empty((0,), dtype=np.int64)
+        while len(rows) < batch_size:
+            candidates = self.np_random.integers(0, self.n_rows, size=batch_size)
+            rows = np.concatenate([rows, candidates[self._has_next(candidates)]])
+        return self.get_transitions(rows[:batch_size], player_id)
+
+    @property
+    def _has_transitions(self):
+        """Whether the next state of any row is known, checked only once.
+        """
+        if self._any_transition is None:
+            # only the last rows of episodes can lack a next state
+            starts, lengths = self.episodes[:, 0], self.episodes[:, 1]
+            self._any_transition = bool((lengths > 1).any() or self._has_next(starts + lengths - 1).any())
+        return self._any_transition
+
+    def _has_next(self, rows):
+        """Check whether the next state of each row is known, which is not the case for the last row of an episode that
+        was interrupted by a reset.
+
+        :param rows: integer array of row indices.
+        :return: boolean mask
+        """
+        starts, lengths = self.episodes[:, 0], self.episodes[:, 1]
+        episode_ids = np.searchsorted(starts, rows, side='right') - 1
+        is_last = rows == starts[episode_ids] + lengths[episode_ids] - 1
+        if not np.any(is_last):
+            return np.ones(len(rows), dtype=bool)
+        has_next = ~is_last
+        has_next[is_last] = self.get_rows(rows[is_last], ('dones',))['dones']
+        return has_next
+
+    def _build_observations(self, data, player_id):
+        scalars = data['scalars'][:, player_id]
+        return build_observations(self.formatting,
+                                  data['codes'],
+                                  data['cursors'][:, player_id],
+                                  scalars[:, 1],
+                                  scalars[:, 0],
+                                  self.one_hot_dim,
+                                  self._permutations[player_id],
+                                  dtype=self.dtype)
+
+    def _open_chunk(self, chunk_id):
+        chunk_dir = os.path.join(self.directory, f'chunk_{chunk_id:05d}')
+        paths = {name: os.path.join(chunk_dir, f'{name}.npy') for name in self._fields + self._optional_fields}
+        return {name: np.load(path, mmap_mode='r') for name, path in paths.items()
+                if name in self._fields or os.path.exists(path)}
@@ -1,16 +1,18 @@
-import logging
 import os
-from os.path import relpath
+from functools import lru_cache
 
+import numpy as np
 from gym import Env
 from gym.spaces import MultiDiscrete, Box, Discrete
-from hydra.experimental import compose, initialize_config_dir
-from hydra.utils import to_absolute_path
-from omegaconf import OmegaConf
 
+from gym_env.async_rendering import AsyncGameRenderer
+from gym_env.game.encoding import encode_observation
 from gym_env.game.game import ExpandoGame
-from gym_env.rendering import GameRenderer
-from gym_env.spaces import OneHot, OneHotBox
+from gym_env.game.metrics import GameMetrics
+from gym_env.history import BoardHistory
+from gym_env.lazy_observation import LazyObservation
+from gym_env.transport import DeltaEncoder
+from gym_env.spaces import OneHot, OneHotBox, SparseBoard
 
 
 class Expando(Env):
@@ -35,6 +37,34 @@ class Expando(Env):
         If `flat_observations` is set to True, the box observations are going to be
         (axis_0 * axis_1 ... * axis_n * n_one_hot + n_scores) dimensional vectors, where n_scores = 3 + n_axis, since
         the cursor's position is on longer represented as bit, but as normalized (x, y, ...) coordinates.
+
+        If `observation_window` is set, only a window of cells centered on the player's cursor is observed, which keeps
+        the observation size constant for growing boards. Each cell's one-hot encoding gets an additional entry marking
+        cells outside of the board. Grid observations have dimensions (w_0 x ... x w_n x (n_one_hot + 1 + 2)) with
+        population and room as the additional channels. Flat observations are (w_0 * ... * w_n * (n_one_hot + 1) +
+        n_axis + 2) dimensional vectors including the normalized cursor coordinates. With `global_summary` set, the
+        one-hot encoding of the whole board average pooled over blocks of `global_summary` cells along each axis is
+        appended to flat observations. The pooled counts are kept up to date on each placement, so the summary doesn't
+        need a pass over the whole board.
+
+        If `history_length` k is larger than 1, observations include the boards of the previous k - 1 steps. With
+        `history_mode='stack'`, the one-hot encodings of all k boards, oldest first, replace the single board's
+        encoding, i.e. n_one_hot becomes k * n_one_hot. With `history_mode='delta'`, k - 1 binary features per cell are
+        appended to the current board's encoding instead, marking the cells that changed between consecutive boards.
+
+        If `sparse_board` is set to True, the board is stored sparsely and observations are dicts from the SparseBoard
+        space, holding the positions and one-hot indices ('codes') of all placed pieces, the cursor position and the
+        normalized population and room. This allows for boards that are too large to be encoded densely.
+
+        Dense observations are float64 arrays by default, while the observation space declares gym's default float32.
+        If `observation_dtype` is set, both the observations and the observation space use that dtype, e.g. float32 to
+        avoid conversions in the policy and halve the size of stored observations.
+
+        If `transport` is set to 'delta', `step()` and `reset()` return small, fixed size messages holding only the
+        cells that changed since the previous message, the cursor and the scalars, see `gym_env/transport.py`. This
+        keeps the data sent from subprocess env workers independent of the board's size. The full observations, in
+        `full_observation_space`, are rebuilt on the receiving side, e.g. by wrapping the vectorized envs with
+        `DeltaDecodingVecEnv` from `gym_env/util/vec_env.py`.
     """
 
     def __init__(self,
@@ -47,7 +77,17 @@ class Expando(Env):
                  observe_all=False,
                  multi_discrete_actions=False,
                  flat_observations=False,
+                 sparse_board=False,
+                 observation_window=None,
+                 global_summary=None,
+                 history_length=1,
+                 history_mode='stack',
+                 observation_dtype=None,
+                 transport=None,
+                 game_metrics=None,
                  render=False,
+                 render_async=False,
+                 render_fps=30,
                  cell_size=50,
                  padding=5,
                  ui_font_size=14,
@@ -63,7 +103,20 @@ class Expando(Env):
         :param observe_all: whether to return observations on `step()` for all players in the info dict or not.
         :param multi_discrete_actions: whether to use a multi-discrete action space.
         :param flat_observations: whether to flatten the observations or return as tensor.
+        :param sparse_board: whether to store the board sparsely and return sparse observations.
+        :param observation_window: size of the observed window around the cursor, either a tuple or a single integer for
+        all axes. Observes the whole board if None.
+        :param global_summary: pooling factor of the board summary appended to flat window observations.
+        :param history_length: number of most recent boards that are observed, including the current one.
+        :param history_mode: 'stack' or 'delta', how previous boards are encoded.
+        :param observation_dtype: floating point dtype of dense observations and the observation space.
+        :param transport: None to return observations of player 0 as they are, or 'delta' to return delta messages.
+        :param game_metrics: dict of keyword arguments of `GameMetrics`, e.g. {'capacity': 1000}, to record telemetry of
+        the played episodes, see `metrics`. No metrics are recorded if None.
         :param render: enables rendering when calling `render()`.
+        :param render_async: whether to draw in a separate process, so that `render()` only publishes a snapshot of the
+        game and never waits for drawing. Snapshots are dropped if drawing can't keep up.
+        :param render_fps: maximum number of snapshots published per second when rendering asynchronously.
         :param cell_size: width/height of a cell when rendering.
         :param padding: padding between cells when rendering.
         :param ui_font_size: size of the ui font when rendering.
@@ -91,32 +144,263 @@ class Expando(Env):
         else:
             self.action_space = Discrete(n_move_directions * n_piece_types)
 
-        # observation space:
-        # (d_0 * ... * d_n * piece_type * player
-        # + cursor_d_0 + ... + cursor_d_n + population + room)
-        k_cursor_features = len(grid_size) if flat_observations else 1
-        obs_dims = grid_size + (1 + (n_piece_types - 1) * n_players,)
-        self.observation_space = OneHotBox(OneHot(obs_dims),
-                                           Box(0.0, 1.0, shape=(2 + k_cursor_features,)),
-                                           flatten=flat_observations)
+        if isinstance(observation_window, int):
+            observation_window = (observation_window,) * len(grid_size)
+        self.observation_window = None if observation_window is None else tuple(observation_window)
+        self.global_summary = global_summary
+        assert global_summary is None or (flat_observations and observation_window is not None and not sparse_board), \
+            'a global summary requires flat, windowed observations of a dense board.'
 
         self.game = ExpandoGame(grid_size, n_players, max_turns, final_reward=final_reward,
                                 piece_types=self.piece_types,
-                                seed=seed)
-        self.observation_format = 'flat' if flat_observations else 'grid'
+                                seed=seed,
+                                sparse_board=sparse_board,
+                                metrics=None if game_metrics is None else GameMetrics(n_players, **game_metrics))
+        if sparse_board and self.observation_window is None:
+            self.observation_format = 'sparse'
+        else:
+            self.observation_format = 'flat' if flat_observations else 'grid'
+
+        self._space_dtype = np.float32 if observation_dtype is None else np.dtype(observation_dtype)
+        self.observation_dtype = np.float64 if observation_dtype is None else np.dtype(observation_dtype)
+        assert np.issubdtype(self.observation_dtype, np.floating), 'observations need a floating point dtype.'
+
+        self.history_length = history_length
+        self.history_mode = history_mode
+        self._history = None
+        if history_length > 1:
+            assert not sparse_board and self.observation_window is None, \
+                'observing the history is only supported for the whole board of a dense game.'
+            self._history = BoardHistory(history_length - 1, grid_size, self.game.board.codes_dtype)
+            self._history.reset(self.game.board.codes)
+
+        self.transport = transport
+        self._delta_encoder = None
+        if transport == 'delta':
+            assert self.observation_format != 'sparse' and self.observation_window is None and self._history is None, \
+                'delta transport is only supported for dense observations of the whole board.'
+            self._delta_encoder = DeltaEncoder(grid_size, n_players)
+        else:
+            assert transport is None, f'unknown transport {transport}.'
+        self._update_observation_spaces()
+        # settings passed to `reconfigure()` that are applied at the next reset
+        self._pending_config = {}
+
         self.do_render = render
-        if self.do_render:
+        if self.do_render and render_async:
+            self.renderer = AsyncGameRenderer(self.game, cell_size, padding, ui_font_size, render_fps)
+        elif self.do_render:
+            # pyglet is only imported when rendering is actually used
+            from gym_env.rendering import GameRenderer
             self.renderer = GameRenderer(self.game, cell_size, padding, ui_font_size)
 
         self.seed(seed)
 
+    def _make_observation_space(self):
+        """Create the observation space matching the observation format.
+
+        :return: a gym space.
+        """
+        grid_size = self.game.grid_size
+        one_hot_dim = self.game.board.one_hot_dim
+        flat = self.observation_format == 'flat'
+
+        if self.observation_format == 'sparse':
+            return SparseBoard(grid_size, one_hot_dim)
+
+        if self.observation_window is not None:
+            window = self.observation_window
+            if not flat:
+                return Box(0.0, 1.0, shape=window + (one_hot_dim + 3,), dtype=self._space_dtype)
+            n_features = np.prod(window) * (one_hot_dim + 1) + len(grid_size) + 2
+            if self.global_summary is not None:
+                n_features += np.prod([-(-d // self.global_summary) for d in grid_size]) * one_hot_dim
+            return Box(0.0, 1.0, shape=(int(n_features),), dtype=self._space_dtype)
+
+        if self._history is not None:
+            k = self._history.length + 1
+            n_features = k * one_hot_dim if self.history_mode == 'stack' else one_hot_dim + k - 1
+            if not flat:
+                return Box(0.0, 1.0, shape=grid_size + (n_features + 3,), dtype=self._space_dtype)
+            return Box(0.0, 1.0, shape=(int(np.prod(grid_size)) * n_features + len(grid_size) + 2,),
+                       dtype=self._space_dtype)
+
+        # observation space:
+        # (d_0 * ... * d_n * piece_type * player
+        # + cursor_d_0 + ... + cursor_d_n + population + room)
+        k_cursor_features = len(grid_size) if flat else 1
+        return OneHotBox(OneHot(grid_size + (one_hot_dim,)),
+                         Box(0.0, 1.0, shape=(2 + k_cursor_features,)),
+                         flatten=flat,
+                         dtype=self._space_dtype)
+
+    def _update_observation_spaces(self):
+        """Create the observation spaces for the current settings. With delta transport, the observation space is the
+        space of the delta messages and `full_observation_space` the space of the rebuilt observations.
+        """
+        self.full_observation_space = self._make_observation_space()
+        if self._delta_encoder is None:
+            self.observation_space = self.full_observation_space
+        else:
+            self.observation_space = self._delta_encoder.observation_space
+
+    def _get_observation(self, player_id):
+        """Get the observation of a player in the configured format.
+
+        :param player_id: id of the observing player.
+        :return: the observation.
+        """
+        if self.observation_window is not None:
+            return self.game.players[player_id].get_window_observation(self.observation_window,
+                                                                       self.observation_format,
+                                                                       self.global_summary,
+                                                                       self.observation_dtype)
+        if self._history is not None:
+            return self._get_history_observation(player_id)
+        return self.game.get_observation(player_id, self.observation_format, self.observation_dtype)
+
+    def _get_history_observation(self, player_id):
+        """Get the observation of a player including the boards of previous steps.
+
+        :param player_id: id of the observing player.
+        :return: the observation.
+        """
+        settings, state = self._encoding_settings(), self._observation_state(player_id)
+        previous_planes = None
+        if self.history_mode == 'stack':
+            # the previous boards are only encoded once per player, see `BoardHistory.encoded_frames()`
+            one_hot_dim, dtype = settings[1], settings[3]
+            previous_planes = self._history.encoded_frames(player_id, state[-1], one_hot_dim, dtype)
+        return encode_observation(*settings, *state, previous_planes=previous_planes)
+
+    def _get_lazy_observation(self, player_id):
+        """Get the observation of a player as LazyObservation, which is only encoded when it is read. Sparse and window
+        observations don't depend on the board's size and are returned as they are. The LazyObservation only holds a
+        snapshot of the state and the settings, so it is cheap to pickle, e.g. as `info['obs_other']` of subprocess
+        envs, and is encoded with the layout at the time of the step, even if the env is reconfigured in between.
+
+        :param player_id: id of the observing player.
+        :return: the observation.
+        """
+        if self.observation_format == 'sparse' or self.observation_window is not None:
+            return self._get_observation(player_id)
+        codes, frames, *state = self._observation_state(player_id)
+        # the board and the history frames change in place
+        return LazyObservation(encode_observation, *self._encoding_settings(), np.array(codes),
+                               None if frames is None else frames.copy(), *state)
+
+    def _encoding_settings(self):
+        """The settings that dense observations are encoded with, see `encoding.encode_observation()`.
+
+        :return: observation format, one-hot dimension, history mode and dtype.
+        """
+        return self.observation_format, self.game.board.one_hot_dim, self.history_mode, self.observation_dtype
+
+    def _observation_state(self, player_id):
+        """Collect the state that a dense observation of a player is built from.
+
+        :return: board codes, previous board codes or None without history, cursor, population, room and the player's
+        perspective permutation.
+        """
+        board, player = self.game.board, self.game.players[player_id]
+        frames = None if self._history is None else self._history.frames
+        return board.dense_codes(), frames, player.cursor.copy(), player.population, player.room, \
+            board.permutation(player_id)
+
+    def _get_agent_observation(self):
+        """Get the observation of player 0 that is returned by `step()`, or a delta message if enabled.
+        """
+        if self._delta_encoder is not None:
+            return self._delta_encoder.encode(self.game)
+        return self._get_observation(0)
+
+    def reconfigure(self, **kwargs):
+        """Change settings that are applied at the next reset, also when the env is reset at the end of an episode, e.g.
+        for curricula over board sizes or opponents. The game, the observation history and the delta encoding are
+        resized in place and their buffers are only reallocated if they need to grow. Note that changing the board's
+        size or the number of players changes the observation space, unless observations are windowed. To reconfigure
+        vectorized envs, use `reconfigure_vec_env()` from `gym_env/util/vec_env.py`.
+
+        :param kwargs: new values of any of 'grid_size', 'n_players', 'max_turns', 'final_reward' and 'policies_other',
+        see `__init__()`. The number of axes of the board is fixed.
+        """
+        unknown = set(kwargs) - {'grid_size', 'n_players', 'max_turns', 'final_reward', 'policies_other'}
+        assert not unknown, f'{unknown} can not be reconfigured.'
+        self._pending_config.update(kwargs)
+
+    def _apply_config(self, grid_size=None, n_players=None, **kwargs):
+        """Apply the settings passed to `reconfigure()`.
+        """
+        if 'max_turns' in kwargs:
+            self.game.max_turns = kwargs['max_turns']
+        if 'final_reward' in kwargs:
+            self.game.final_reward = kwargs['final_reward']
+        if 'policies_other' in kwargs:
+            self.policies_other = kwargs['policies_other']
+
+        if grid_size is not None or n_players is not None:
+            assert not self.do_render, 'the board can not be resized while rendering.'
+            grid_size = self.game.grid_size if grid_size is None else tuple(grid_size)
+            self.n_players = self.n_players if n_players is None else n_players
+            self.game.resize(grid_size, self.n_players)
+            if self._history is not None:
+                self._history.resize(grid_size, self.game.board.codes_dtype)
+            if self._delta_encoder is not None:
+                self._delta_encoder = DeltaEncoder(grid_size, self.n_players)
+            self._update_observation_spaces()
+
+        if self.policies_other is not None:
+            assert self.n_players - 1 == len(self.policies_other), 'please provide a policy for each opponent.'
+
+    def _reset_game(self):
+        """Apply pending settings and reset the game, the observed history and the delta encoding.
+        """
+        if self._pending_config:
+            self._apply_config(**self._pending_config)
+            self._pending_config = {}
+        self.game.reset()
+        if self._history is not None:
+            self._history.reset(self.game.board.codes)
+        if self._delta_encoder is not None:
+            self._delta_encoder.reset()
+
+    @property
+    def metrics(self):
+        """The game's metrics, e.g. `env.metrics.summary()`, or `venv.get_attr('metrics')` for vectorized envs. None
+        if `game_metrics` wasn't set.
+        """
+        return self.game.metrics
+
+    @property
+    def transport_layout(self):
+        """Everything needed to decode delta messages into full observations, see `transport.DeltaDecoder`.
+
+        :return: dict of keyword arguments.
+        """
+        return {'grid_size': self.game.grid_size,
+                'n_players': self.n_players,
+                'one_hot_dim': self.game.board.one_hot_dim,
+                'formatting': self.observation_format,
+                'dtype': self.observation_dtype}
+
+    def _get_all_observations(self):
+        """Get the observations of all players in the configured format, see `step_all()`.
+        """
+        if self.observation_window is not None or self._history is not None:
+            observations = [self._get_observation(i) for i in range(self.n_players)]
+            return np.concatenate(observations) if self.observation_format == 'flat' else np.stack(observations)
+        return self.game.get_all_observations(self.observation_format, self.observation_dtype)
+
     def step(self, action, other_actions=None):
         """Perform each player's turn.
 
         :param action: action to take as player 0
         :param other_actions: optional list of actions to take for the other players. Will be sampled from actions_space
         if not provided.
-        :return: obs_0, reward_0, done, info
+        :return: obs_0, reward_0, done, info. At the end of an episode, info['episode_stats'] holds a summary of the
+        episode for player 0, see `ExpandoGame.get_episode_stats()`. With `observe_all`, info['obs_other'] holds the
+        other players' observations as LazyObservations, which are only encoded when read, e.g. with `np.asarray()`.
+        The observations passed to `policies_other` are lazy as well.
         """
         if self.policies_other is not None:
             assert other_actions is None, 'other actions are already defined by the policies passed at initialization'
@@ -127,7 +411,7 @@ class Expando(Env):
             rewards_other = [self.game.take_turn(action, i) for i, action in enumerate(other_actions, start=1)]
         # other player actions defined by policies passed to constructor
         elif self.policies_other is not None:
-            other_obs = [self.game.get_observation(i, self.observation_format) for i in range(1, self.n_players)]
+            other_obs = [self._get_lazy_observation(i) for i in range(1, self.n_players)]
             actions_other = [policy.predict(obs)[0][0] for obs, policy in zip(other_obs, self.policies_other)]
             rewards_other = [self.game.take_turn(a, i) for i, a in enumerate(actions_other, start=1)]
         # no other player actions provided: sample
@@ -136,18 +420,64 @@ class Expando(Env):
 
         info = {}
         if self.observe_all:
-            other_obs_new = [self.game.get_observation(i, self.observation_format) for i in range(1, self.n_players)]
+            other_obs_new = [self._get_lazy_observation(i) for i in range(1, self.n_players)]
             info = {'rewards_other': rewards_other, 'obs_other': other_obs_new}
 
         reward_0 = self.game.take_turn(action, player_id=0)
-        obs_0 = self.game.get_observation(player_id=0, formatting=self.observation_format)
+        obs_0 = self._get_agent_observation()
         done = self.game.is_done
 
         if done:
-            self.game.reset()
+            info['episode_stats'] = self.game.get_episode_stats(player_id=0)
+            self._reset_game()
+        elif self._history is not None:
+            self._history.push(self.game.board.codes)
 
         return obs_0, reward_0, done, info
 
+    def step_all(self, actions):
+        """Perform a turn for every player at once, with the actions of all players given. Intended for multi-agent
+        learners, `policies_other` are not used. The actions are applied in the same turn order as in `step()`, i.e.
+        player 1 to n first and player 0 last.
+
+        :param actions: integer array of shape (n_players,), or (n_players, 2) for multi-discrete actions, holding the
+        action of each player indexed by player_id.
+        :return: observations of shape (n_players, ...), rewards of shape (n_players,), dones of shape (n_players,),
+        info. At the end of an episode, info['episode_stats'] holds a list of each player's episode statistics. With
+        `sparse_board`, observations are a list of each player's sparse observation. Observations are never delta
+        encoded, so `step_all()` should not be mixed with `step()` when using delta transport.
+        """
+        actions = np.asarray(actions)
+        assert len(actions) == self.n_players, 'please provide an action for each player'
+
+        rewards = np.zeros(self.n_players)
+        for player_id in self._turn_order:
+            # multi-discrete actions are expected as lists
+            rewards[player_id] = self.game.take_turn(actions[player_id].tolist(), player_id)
+
+        observations = self._get_all_observations()
+        dones = np.full(self.n_players, self.game.is_done)
+        info = {}
+        if self.game.is_done:
+            info['episode_stats'] = [self.game.get_episode_stats(i) for i in range(self.n_players)]
+            self._reset_game()
+        elif self._history is not None:
+            self._history.push(self.game.board.codes)
+
+        return observations, rewards, dones, info
+
+    def reset_all(self):
+        """Reset the environment and return the first observations of all players.
+
+        :return: observations of shape (n_players, ...), see `step_all()`.
+        """
+        self._reset_game()
+        return self._get_all_observations()
+
+    @property
+    def _turn_order(self):
+        return list(range(1, self.n_players)) + [0]
+
     def seed(self, seed=None):
         """Set seeds of all random number generators. Note that pseudo random actions are performed at initialization,
         so in order to seed these actions as well you need to pass a seed to the constructor.
@@ -164,10 +494,12 @@ class Expando(Env):
         :param player_id: id of the player to get the first observation from.
         :return: observation of player with player_id or a list of all observations if `observe_all` was set.
         """
-        self.game.reset()
+        self._reset_game()
         if self.observe_all:
-            return [self.game.get_observation(i, self.observation_format) for i in range(self.n_players)]
-        return self.game.get_observation(player_id, self.observation_format)
+            return [self._get_agent_observation()] + [self._get_observation(i) for i in range(1, self.n_players)]
+        if player_id == 0:
+            return self._get_agent_observation()
+        return self._get_observation(player_id)
 
     def render(self, mode='human'):
         """Render a pyglet visualization. Only works with 2D grids.
@@ -176,6 +508,12 @@ class Expando(Env):
         if self.do_render:
             self.renderer.step()
 
+    def close(self):
+        """Stop the render process when rendering asynchronously.
+        """
+        if self.do_render and isinstance(self.renderer, AsyncGameRenderer):
+            self.renderer.close()
+
     @staticmethod
     def from_config(file_path):
         """Load environment using a yaml configuration file or a composable hydra config
@@ -183,20 +521,21 @@ class Expando(Env):
         :param file_path: path to the config file
         :return: A configured Expando environment
         """
-        file_path = to_absolute_path(file_path)
-        conf_dir, file_name = os.path.split(file_path)
-        with initialize_config_dir(conf_dir):
-            cfg = compose(config_name=file_name)
+        from gym_env.util.io import load_hydra_config
 
+        cfg = load_hydra_config(file_path)
         env = Expando(**cfg)
         return env
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def _get_default_piece_types():
-        """Load the default piece types from default_config/
+        """Load the default piece types from default_config/. The file is only parsed once per process.
 
         :return: DictConfig containing piece_types
         """
-        this_file_dir = os.path.split(relpath(__file__))[0]
+        from omegaconf import OmegaConf
+
+        this_file_dir = os.path.dirname(os.path.abspath(__file__))
         path = os.path.join(this_file_dir, 'default_config/piece_types.yaml')
         return OmegaConf.load(path).piece_types
@@ -0,0 +1,101 @@
+"""Lookup tables for decoding the actions of Expando.
+
+An action is a pair (cursor move, piece id), or a single discrete action enumerating all pairs in the order of
+`itertools.product()`, i.e. discrete action = cursor move * n_piece_types + piece id. Cursor moves are in
+[0, 2 * n_dims], where 0 doesn't move the cursor, 1 <= k <= n_dims moves it by +1 along the (k - 1)-th axis and
+n_dims < k <= 2 * n_dims moves it by -1 along the ((k + 1) mod n_dims)-th axis. Piece id 0 is the empty piece, i.e. no
+piece is placed.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def get_action_table(n_dims, n_piece_types):
+    """Get the action table of a game configuration. Tables are cached per process and must not be modified.
+
+    :param n_dims: number of axes of the board.
+    :param n_piece_types: number of piece types, including the empty piece.
+    :return: an ActionTable.
+    """
+    return ActionTable(n_dims, n_piece_types)
+
+
+class ActionTable:
+    """Precomputed lookup arrays from actions to cursor moves, direction vectors and piece ids, for decoding single
+    actions without allocations and batches of actions with array operations. All arrays are read-only.
+    """
+
+    def __init__(self, n_dims, n_piece_types):
+        """
+
+        :param n_dims: number of axes of the board.
+        :param n_piece_types: number of piece types, including the empty piece.
+        """
+        self.n_dims = n_dims
+        self.n_piece_types = n_piece_types
+        self.n_moves = 2 * n_dims + 1
+        self.n_actions = self.n_moves * n_piece_types
+
+        # direction vector of each cursor move
+        self.directions = np.zeros((self.n_moves, n_dims), dtype=np.int64)
+        for axis in range(n_dims):
+            self.directions[1 + axis, axis] = 1
+            self.directions[1 + n_dims + axis, (2 + n_dims + axis) % n_dims] = -1
+        # cursor move and piece id of each discrete action
+        self.moves = np.repeat(np.arange(self.n_moves), n_piece_types)
+        self.piece_ids = np.tile(np.arange(n_piece_types), self.n_moves)
+        # cursor move for a step of -1 (row 0) and +1 (row 1) along each axis
+        self.axis_moves = np.zeros((2, n_dims), dtype=np.int64)
+        for move in range(1, self.n_moves):
+            axis = self.directions[move].nonzero()[0][0]
+            self.axis_moves[int(self.directions[move, axis] > 0), axis] = move
+
+        for array in (self.directions, self.moves, self.piece_ids, self.axis_moves):
+            array.flags.writeable = False
+        # python objects for decoding single actions
+        self._pairs = [(int(m), int(p)) for m, p in zip(self.moves, self.piece_ids)]
+        self._direction_rows = list(self.directions)
+
+    def decode(self, action):
+        """Decode a single action.
+
+        :param action: discrete action as integer, or multi-discrete action as pair of integers.
+        :return: cursor move, read-only direction vector and piece id.
+        """
+        if isinstance(action, (list, tuple)) or getattr(action, 'ndim', 0) > 0:
+            move, piece_id = action
+            assert 0 <= move < self.n_moves and 0 <= piece_id < self.n_piece_types, f'invalid action {action}.'
+        else:
+            # negative indices would silently wrap around
+            assert 0 <= action < self.n_actions, f'invalid action {action}.'
+            move, piece_id = self._pairs[action]
+        return move, self._direction_rows[move], piece_id
+
+    def decode_batch(self, actions):
+        """Decode a batch of actions.
+
+        :param actions: integer array of discrete actions with shape (batch,) or multi-discrete actions with shape
+        (batch, 2).
+        :return: cursor moves of shape (batch,), direction vectors of shape (batch, n_dims) and piece ids of shape
+        (batch,).
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        if actions.ndim == 1:
+            moves, piece_ids = self.moves[actions], self.piece_ids[actions]
+        else:
+            moves, piece_ids = actions[:, 0], actions[:, 1]
+        return moves, self.directions[moves], piece_ids
+
+    def encode(self, moves, piece_ids, multi_discrete=False):
+        """Encode cursor moves and piece ids as actions.
+
+        :param moves: integer array of cursor moves.
+        :param piece_ids: integer array of piece ids.
+        :param multi_discrete: whether to return multi-discrete actions of shape (batch, 2) or discrete actions.
+        :return: integer array of actions.
+        """
+        if multi_discrete:
+            return np.stack([moves, piece_ids], axis=-1)
+        return moves * self.n_piece_types + piece_ids
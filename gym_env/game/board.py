@@ -1,30 +1,74 @@
 import itertools
-from collections import defaultdict
+from functools import reduce
+from operator import mul
 
 import numpy as np
 
+from gym_env.game.encoding import perspective_permutation, codes_to_one_hot, pooled_one_hot
 from gym_env.game.pieces import Empty
+from gym_env.game.zobrist import cell_key
 
 
 class Board:
     """Board representation for the Expando Game.
     """
 
-    def __init__(self, grid_size, game):
+    def __init__(self, grid_size, game, sparse=False):
         """
         :param grid_size: dimensions of the board.
         :param game: game which the board belongs to.
+        :param sparse: if True, no dense array of cell codes is kept, so memory and per-turn work only scale with the
+        number of placed pieces. Dense observations are still available but built on demand.
         """
-        self.grid_size = grid_size
+        self.sparse = sparse
         self.name_to_id = game.name_to_id
         # shared empty field
         self.empty_field = Empty(None, self)
+        self._n_piece_types = len(self.name_to_id) - 1
+
+        self.grid_size = None
+        self.n_cells = None
+        self.one_hot_dim = None
+        self._n_players = None
+        self._permutations = {}
+
+        # categorical code of each cell, i.e. the index of the cell's one-hot encoding as seen by player 0
+        self.codes_dtype = None
+        self.codes = None
+        # flat buffer that `codes` is a view of, only reallocated when the board grows
+        self._code_buffer = None
         self.grid = None
-        self.reset_grid()
+        # positions and codes of all placed pieces in order of placement
+        self.placed_positions = None
+        self.placed_codes = None
+        # zobrist hash of the placed pieces, see `zobrist.py`
+        self.hash = 0
+        # compiled rules of the rule piece types, see `rules.py`, set by the game
+        self.rules = None
+        # number of cells of each code per block of cells, by pooling factor, see `pooled_counts()`
+        self._pooled_counts = {}
+        self.resize(grid_size, game.n_players)
 
-        self.one_hot_dim = 1 + game.n_players * (len(game.name_to_id) - 1)
-        self._n_piece_types = len(self.name_to_id) - 1
-        self._one_hots = np.eye(self.one_hot_dim)
+    def resize(self, grid_size, n_players):
+        """Change the board's dimensions and the number of players, and clear the grid. The buffer holding the codes of
+        the cells is reused if it is large enough.
+
+        :param grid_size: new dimensions of the board.
+        :param n_players: new number of players.
+        """
+        self.grid_size = grid_size
+        self.n_cells = reduce(mul, grid_size, 1)
+        self.one_hot_dim = 1 + n_players * self._n_piece_types
+        self._n_players = n_players
+        self._permutations = {}
+
+        self.codes_dtype = np.min_scalar_type(self.one_hot_dim - 1)
+        if not self.sparse and (self._code_buffer is None or len(self._code_buffer) < self.n_cells
+                                or self._code_buffer.dtype != self.codes_dtype):
+            self._code_buffer = np.zeros(self.n_cells, dtype=self.codes_dtype)
+        if self.rules is not None:
+            self.rules.resize(grid_size, n_players)
+        self.reset_grid()
 
     @property
     def all_positions(self):
@@ -40,7 +84,7 @@ class Board:
         :return: piece or Empty piece.
         """
         if self.is_within_grid(coordinates):
-            return self.grid[coordinates]
+            return self.grid.get(coordinates, self.empty_field)
         return self.empty_field
 
     def place_piece(self, piece, coordinates):
@@ -52,14 +96,90 @@ class Board:
         :rtype: bool
         """
         if self.is_within_grid(coordinates) and not self.is_occupied(coordinates):
+            code = self.piece_code(piece)
             self.grid[coordinates] = piece
+            self.placed_positions.append(coordinates)
+            self.placed_codes.append(code)
+            self.hash ^= cell_key(coordinates, code)
+            if not self.sparse:
+                self.codes[coordinates] = code
+            for factor, counts in self._pooled_counts.items():
+                block = tuple(c // factor for c in coordinates)
+                counts[block + (0,)] -= 1
+                counts[block + (code,)] += 1
+            if self.rules is not None:
+                self.rules.place(coordinates)
             return True
         return False
 
     def reset_grid(self):
         """Clear the grid.
         """
-        self.grid = defaultdict(lambda: self.empty_field)
+        self.grid = {}
+        self.placed_positions = []
+        self.placed_codes = []
+        self.hash = 0
+        self._pooled_counts = {}
+        if not self.sparse:
+            self.codes = self._code_buffer[:self.n_cells].reshape(self.grid_size)
+            self.codes[...] = 0
+        if self.rules is not None:
+            self.rules.reset()
+
+    def dense_codes(self):
+        """Get the codes of all cells as dense array. In sparse mode, the array is built on demand.
+
+        :return: integer numpy array of shape grid_size.
+        """
+        if not self.sparse:
+            return self.codes
+        codes = np.zeros(self.grid_size, dtype=self.codes_dtype)
+        if self.placed_positions:
+            codes[tuple(np.array(self.placed_positions).T)] = self.placed_codes
+        return codes
+
+    def sparse_codes(self, observing_player_id=0):
+        """Get the positions and codes of all placed pieces.
+
+        :param observing_player_id: id of the player that observes, see `to_one_hot()`.
+        :return: integer numpy arrays of shape (n_pieces, n_dims) and (n_pieces,)
+        """
+        positions = np.array(self.placed_positions, dtype=np.int64).reshape(-1, len(self.grid_size))
+        codes = self.permutation(observing_player_id)[np.array(self.placed_codes, dtype=np.int64)]
+        return positions, codes
+
+    def window_codes(self, center, window_size):
+        """Get the codes of a window of cells around a center position. Cells outside of the board are given the
+        code `one_hot_dim`. The cost only depends on the window size, also in sparse mode.
+
+        :param center: position that the window is centered on.
+        :param window_size: number of cells along each axis of the window.
+        :return: integer numpy array of shape window_size.
+        """
+        lower = np.asarray(center) - np.asarray(window_size) // 2
+        window = np.full(window_size, self.one_hot_dim, dtype=np.min_scalar_type(self.one_hot_dim))
+
+        if not self.sparse:
+            src = tuple(slice(max(lo, 0), min(lo + w, d)) for lo, w, d in zip(lower, window_size, self.grid_size))
+            dst = tuple(slice(s.start - lo, s.stop - lo) for s, lo in zip(src, lower))
+            window[dst] = self.codes[src]
+            return window
+
+        for offset in itertools.product(*(range(w) for w in window_size)):
+            position = tuple(lower + offset)
+            if self.is_within_grid(position):
+                window[offset] = self.piece_code(self.get_piece(position))
+        return window
+
+    def piece_code(self, piece):
+        """Get the categorical code of a piece, i.e. the index of its one-hot encoding from player 0's perspective.
+
+        :param piece: the piece to encode.
+        :return: integer code, 0 for the empty field.
+        """
+        if piece is self.empty_field:
+            return 0
+        return self.name_to_id[piece.name] + self._n_piece_types * piece.player.player_id
 
     def is_within_grid(self, position):
         """Check whether position is a legal position on the board.
@@ -79,44 +199,60 @@ class Board:
         :param position: the position to check on the board.
         :return: bool whether position is occupied
         """
-        return self.grid[position] is not self.empty_field
+        return position in self.grid
 
     def is_full(self):
         """Check whether all fields on the board are occupied.
 
         :return: True if board is filled with pieces.
         """
-        return all([self.is_occupied(pos) for pos in self.all_positions])
+        return len(self.grid) >= self.n_cells
 
-    def _piece_to_one_hot(self, piece, observing_player_id):
-        """Encode a piece as one-hot depending relative to the observing player, i.e. the player sees herself as player
-        0.
+    def permutation(self, observing_player_id):
+        """Get the lookup table that maps codes to the codes seen by the observing player.
 
-        :param piece: the piece to encode.
-        :param observing_player_id: the player_id of the player that observes the piece
-        :return: numpy array as one-hot encoding
-        """
-        piece_type_id = self.name_to_id[piece.name]
-        # empty piece doesn't belong to a player
-        if piece == self.empty_field:
-            return self._one_hots[0]
-
-        piece_player_id = piece.player.player_id
-        # swap player 0 and observing player
-        if observing_player_id != 0:
-            if piece_player_id == 0:
-                player_id = observing_player_id
-            elif observing_player_id == piece_player_id:
-                player_id = 0
-            else:
-                player_id = piece_player_id
-        else:
-            player_id = piece_player_id
-
-        # lookup one-hot
-        one_hot_id = piece_type_id + self._n_piece_types * player_id
-        assert one_hot_id != 0
-        return self._one_hots[one_hot_id]
+        :param observing_player_id: id of the player that observes the board.
+        :return: integer numpy array, see `encoding.perspective_permutation()`.
+        """
+        if observing_player_id not in self._permutations:
+            self._permutations[observing_player_id] = perspective_permutation(observing_player_id, self._n_players,
+                                                                              self._n_piece_types)
+        return self._permutations[observing_player_id]
+
+    @property
+    def all_permutations(self):
+        """Get the lookup tables of all players stacked, see `permutation()`.
+
+        :return: integer numpy array of shape (n_players, one_hot_dim)
+        """
+        if 'all' not in self._permutations:
+            self._permutations['all'] = np.stack([self.permutation(i) for i in range(self._n_players)])
+        return self._permutations['all']
+
+    def pooled_counts(self, factor):
+        """Count the cells of each code in blocks of `factor` cells along each axis, see `encoding.pooled_one_hot()`.
+        The counts are computed once per episode and factor, and then updated on each placement.
+
+        :param factor: size of the blocks along each axis.
+        :return: int64 array of shape (ceil(d_0 / factor), ..., ceil(d_n / factor), one_hot_dim), which must not be
+        modified.
+        """
+        if factor not in self._pooled_counts:
+            pooled = pooled_one_hot(self.dense_codes()[None], self.one_hot_dim, factor)[0]
+            self._pooled_counts[factor] = np.rint(pooled * factor ** len(self.grid_size)).astype(np.int64)
+        return self._pooled_counts[factor]
+
+    def pooled_one_hot(self, factor, observing_player_id=0, dtype=np.float64):
+        """Get the one-hot encoding of the board average pooled over blocks of cells, from the cached counts.
+
+        :param factor: size of the blocks along each axis.
+        :param observing_player_id: id of the player that observes the board.
+        :param dtype: dtype of the result.
+        :return: the same array as `encoding.pooled_one_hot()` for the board, without the batch dimension.
+        """
+        # the encoding of code c is moved to index permutation[c]
+        inverse = np.argsort(self.permutation(observing_player_id))
+        return self.pooled_counts(factor)[..., inverse].astype(dtype) / factor ** len(self.grid_size)
 
     def to_one_hot(self, observing_player_id=0):
         """Get a one-hot representation of the grid.
@@ -125,8 +261,4 @@ class Board:
         the player was player 0.
         :return: one-hot encoding of the board from observing player's perspective.
         """
-        one_hot_grid = np.zeros((*self.grid_size, self.one_hot_dim))
-        for vec in self.all_positions:
-            one_hot_grid[vec] = self._piece_to_one_hot(self.grid[vec], observing_player_id)
-
-        return one_hot_grid
+        return codes_to_one_hot(self.dense_codes(), self.one_hot_dim, self.permutation(observing_player_id))
@@ -0,0 +1,235 @@
+"""Vectorized encoding of categorical board codes into the observation formats of the Expando environment.
+
+All functions operate on batches, i.e. arrays with a leading batch dimension, so that observations can be rebuilt for
+many states at once, e.g. from recorded episodes. The categorical code of a cell is the index of its one-hot encoding
+as seen by player 0, see `Board.piece_code()`.
+"""
+import numpy as np
+
+
+def perspective_permutation(observing_player_id, n_players, n_piece_types):
+    """Get a lookup table that maps codes from player 0's perspective to the observing player's perspective, i.e. the
+    pieces of player 0 and the observing player swap their codes.
+
+    :param observing_player_id: id of the player that observes the board.
+    :param n_players: number of players in the game.
+    :param n_piece_types: number of piece types, not counting the empty piece.
+    :return: integer array of size 1 + n_players * n_piece_types.
+    """
+    player_ids = np.arange(n_players)
+    player_ids[[0, observing_player_id]] = player_ids[[observing_player_id, 0]]
+    codes = 1 + np.arange(n_piece_types) + n_piece_types * player_ids[:, None]
+    return np.concatenate([[0], codes.ravel()])
+
+
+def codes_to_one_hot(codes, one_hot_dim, permutation=None, dtype=np.float64):
+    """Encode categorical codes as one-hot vectors.
+
+    :param codes: integer array of codes.
+    :param one_hot_dim: size of the one-hot encodings.
+    :param permutation: optional lookup table, applied to the codes before encoding.
+    :param dtype: dtype of the encodings.
+    :return: array of shape codes.shape + (one_hot_dim,)
+    """
+    if permutation is not None:
+        codes = permutation[codes]
+    return np.eye(one_hot_dim, dtype=dtype)[codes]
+
+
+def grid_observations(codes, cursors, populations, rooms, one_hot_dim, permutation=None, dtype=np.float64):
+    """Build a batch of observations in 'grid' format.
+
+    :param codes: board codes of shape (batch, d_0, ..., d_n).
+    :param cursors: cursor positions of the observing player, shape (batch, n_dims).
+    :param populations: populations of the observing player, shape (batch,).
+    :param rooms: rooms of the observing player, shape (batch,).
+    :param one_hot_dim: size of the one-hot encodings.
+    :param permutation: optional perspective lookup table, see `perspective_permutation()`.
+    :param dtype: dtype of the observations.
+    :return: array of shape (batch, d_0, ..., d_n, one_hot_dim + 3).
+    """
+    planes = codes_to_one_hot(codes, one_hot_dim, permutation, dtype)
+    return grid_observations_from_planes(planes, cursors, populations, rooms, dtype)
+
+
+def flat_observations(codes, cursors, populations, rooms, one_hot_dim, permutation=None, dtype=np.float64):
+    """Build a batch of observations in 'flat' format.
+
+    :param codes: board codes of shape (batch, d_0, ..., d_n).
+    :param cursors: cursor positions of the observing player, shape (batch, n_dims).
+    :param populations: populations of the observing player, shape (batch,).
+    :param rooms: rooms of the observing player, shape (batch,).
+    :param one_hot_dim: size of the one-hot encodings.
+    :param permutation: optional perspective lookup table, see `perspective_permutation()`.
+    :param dtype: dtype of the observations.
+    :return: array of shape (batch, d_0 * ... * d_n * one_hot_dim + n_dims + 2).
+    """
+    planes = codes_to_one_hot(codes, one_hot_dim, permutation, dtype)
+    return flat_observations_from_planes(planes, cursors, populations, rooms, dtype)
+
+
+def grid_observations_from_planes(planes, cursors, populations, rooms, dtype=np.float64):
+    """Build a batch of observations in 'grid' format from per-cell features, e.g. one-hot encodings.
+
+    :param planes: features of each cell, shape (batch, d_0, ..., d_n, n_features).
+    :param cursors: cursor positions of the observing player, shape (batch, n_dims).
+    :param populations: populations of the observing player, shape (batch,).
+    :param rooms: rooms of the observing player, shape (batch,).
+    :param dtype: dtype of the observations.
+    :return: array of shape (batch, d_0, ..., d_n, n_features + 3).
+    """
+    batch_size, grid_size, n_features = planes.shape[0], planes.shape[1:-1], planes.shape[-1]
+    n_grid = np.prod(grid_size)
+
+    obs = np.empty(planes.shape[:-1] + (n_features + 3,), dtype=dtype)
+    obs[..., :n_features] = planes
+    obs[..., n_features] = 0
+    batch_idx = np.arange(batch_size)
+    obs[(batch_idx,) + tuple(np.asarray(cursors).T) + (n_features,)] = 1
+
+    scalar_shape = (batch_size,) + (1,) * len(grid_size)
+    obs[..., n_features + 1] = np.reshape(populations, scalar_shape).astype(np.float64) / n_grid
+    obs[..., n_features + 2] = np.reshape(rooms, scalar_shape).astype(np.float64) / n_grid
+    return obs
+
+
+def flat_observations_from_planes(planes, cursors, populations, rooms, dtype=np.float64):
+    """Build a batch of observations in 'flat' format from per-cell features, e.g. one-hot encodings.
+
+    :param planes: features of each cell, shape (batch, d_0, ..., d_n, n_features).
+    :param cursors: cursor positions of the observing player, shape (batch, n_dims).
+    :param populations: populations of the observing player, shape (batch,).
+    :param rooms: rooms of the observing player, shape (batch,).
+    :param dtype: dtype of the observations.
+    :return: array of shape (batch, d_0 * ... * d_n * n_features + n_dims + 2).
+    """
+    batch_size, grid_size = planes.shape[0], planes.shape[1:-1]
+    n_grid = np.prod(grid_size)
+    n_planes = planes[0].size
+    n_dims = len(grid_size)
+
+    obs = np.empty((batch_size, n_planes + n_dims + 2), dtype=dtype)
+    obs[:, :n_planes] = planes.reshape(batch_size, -1)
+    obs[:, n_planes:n_planes + n_dims] = np.asarray(cursors) / np.array(grid_size)
+    obs[:, -2] = np.asarray(populations, dtype=np.float64) / n_grid
+    obs[:, -1] = np.asarray(rooms, dtype=np.float64) / n_grid
+    return obs
+
+
+def history_planes(previous, codes, one_hot_dim, permutation=None, mode='stack', dtype=np.float64,
+                   previous_planes=None):
+    """Encode the current boards together with the boards of previous steps.
+
+    :param previous: codes of the previous boards, oldest first, shape (batch, k - 1, d_0, ..., d_n).
+    :param codes: codes of the current boards, shape (batch, d_0, ..., d_n).
+    :param one_hot_dim: size of the one-hot encodings.
+    :param permutation: optional perspective lookup table, see `perspective_permutation()`.
+    :param mode: 'stack' to concatenate the one-hot encodings of all k boards, oldest first, along the last axis.
+    'delta' to append k - 1 binary planes to the current board's one-hot encoding, marking the cells that changed
+    between consecutive boards.
+    :param dtype: dtype of the encodings.
+    :param previous_planes: optional one-hot encodings of the previous boards for 'stack', shape (batch, k - 1, d_0,
+    ..., d_n, one_hot_dim), e.g. cached by `BoardHistory.encoded_frames()`, which are copied instead of encoding the
+    previous boards again.
+    :return: array of shape (batch, d_0, ..., d_n, k * one_hot_dim) for 'stack' or (batch, d_0, ..., d_n,
+    one_hot_dim + k - 1) for 'delta'.
+    """
+    n_previous = previous.shape[1]
+    if mode == 'stack':
+        planes = np.empty(codes.shape + (n_previous + 1, one_hot_dim), dtype=dtype)
+        if previous_planes is not None:
+            planes[..., :n_previous, :] = np.moveaxis(previous_planes, 1, -2)
+        else:
+            for i in range(n_previous):
+                planes[..., i, :] = codes_to_one_hot(previous[:, i], one_hot_dim, permutation, dtype)
+        planes[..., n_previous, :] = codes_to_one_hot(codes, one_hot_dim, permutation, dtype)
+        return planes.reshape(codes.shape + (-1,))
+    elif mode == 'delta':
+        planes = np.empty(codes.shape + (one_hot_dim + n_previous,), dtype=dtype)
+        planes[..., :one_hot_dim] = codes_to_one_hot(codes, one_hot_dim, permutation, dtype)
+        for i in range(n_previous):
+            newer = previous[:, i + 1] if i + 1 < n_previous else codes
+            planes[..., one_hot_dim + i] = previous[:, i] != newer
+        return planes
+    raise NotImplementedError()
+
+
+def build_observations(formatting, *args, **kwargs):
+    """Build a batch of observations in the given format, see `grid_observations()` and `flat_observations()`.
+
+    :param formatting: 'flat' or 'grid'.
+    :return: a batch of observations as numpy array.
+    """
+    if formatting == 'grid':
+        return grid_observations(*args, **kwargs)
+    elif formatting == 'flat':
+        return flat_observations(*args, **kwargs)
+    raise NotImplementedError()
+
+
+def pooled_one_hot(codes, one_hot_dim, factor, permutation=None, dtype=np.float64):
+    """Downsample the one-hot encoding of a board by average pooling over blocks of `factor` cells along each axis.
+    Boards that are not divisible by `factor` are padded, where padded cells do not count towards any code.
+
+    :param codes: board codes of shape (batch, d_0, ..., d_n).
+    :param one_hot_dim: size of the one-hot encodings.
+    :param factor: size of the pooling blocks along each axis.
+    :param permutation: optional perspective lookup table, see `perspective_permutation()`.
+    :param dtype: dtype of the result.
+    :return: array of shape (batch, ceil(d_0 / factor), ..., ceil(d_n / factor), one_hot_dim)
+    """
+    if permutation is not None:
+        codes = permutation[codes]
+    grid_size = codes.shape[1:]
+    pooled_size = tuple(-(-d // factor) for d in grid_size)
+
+    # padded cells get an extra code, which is dropped after pooling
+    padded = np.full(codes.shape[:1] + tuple(d * factor for d in pooled_size), one_hot_dim, dtype=np.int64)
+    padded[(slice(None),) + tuple(slice(0, d) for d in grid_size)] = codes
+    one_hots = np.eye(one_hot_dim + 1, dtype=dtype)[padded]
+
+    blocks = one_hots.reshape(codes.shape[:1] + sum(((d, factor) for d in pooled_size), ()) + (one_hot_dim + 1,))
+    pooled = blocks.mean(axis=tuple(range(2, 2 * len(grid_size) + 1, 2)))
+    return pooled[..., :one_hot_dim]
+
+
+def observations_from_planes(formatting, *args, **kwargs):
+    """Build a batch of observations from per-cell features in the given format, see
+    `grid_observations_from_planes()` and `flat_observations_from_planes()`.
+
+    :param formatting: 'flat' or 'grid'.
+    :return: a batch of observations as numpy array.
+    """
+    if formatting == 'grid':
+        return grid_observations_from_planes(*args, **kwargs)
+    elif formatting == 'flat':
+        return flat_observations_from_planes(*args, **kwargs)
+    raise NotImplementedError()
+
+
+def encode_observation(formatting, one_hot_dim, history_mode, dtype, codes, previous, cursor, population, room,
+                       permutation, previous_planes=None):
+    """Encode a single dense observation, optionally including the boards of previous steps. All inputs are passed
+    explicitly, so that the encoding can be deferred or run in another process, see `LazyObservation`.
+
+    :param formatting: 'flat' or 'grid'.
+    :param one_hot_dim: size of the one-hot encodings.
+    :param history_mode: 'stack' or 'delta', see `history_planes()`. Ignored without previous boards.
+    :param dtype: dtype of the observation.
+    :param codes: codes of the board, shape (d_0, ..., d_n).
+    :param previous: codes of the previous boards, oldest first, shape (k - 1, d_0, ..., d_n), or None.
+    :param cursor: cursor position of the observing player.
+    :param population: population of the observing player.
+    :param room: room of the observing player.
+    :param permutation: perspective lookup table of the observing player, see `perspective_permutation()`.
+    :param previous_planes: optional one-hot encodings of the previous boards, see `history_planes()`.
+    :return: the observation, with a batch dimension of size 1 for 'flat', like `Player.get_flat_observation()`.
+    """
+    if previous is None:
+        obs = build_observations(formatting, codes[None], cursor[None], [population], [room], one_hot_dim,
+                                 permutation, dtype=dtype)
+    else:
+        planes = history_planes(previous[None], codes[None], one_hot_dim, permutation, history_mode, dtype,
+                                None if previous_planes is None else previous_planes[None])
+        obs = observations_from_planes(formatting, planes, cursor[None], [population], [room], dtype)
+    return obs if formatting == 'flat' else obs[0]
@@ -1,12 +1,41 @@
-import itertools
 from copy import copy
 
 import numpy as np
-from hydra.utils import instantiate
 from numpy.random import default_rng
 
+from gym_env.game.actions import get_action_table
 from gym_env.game.board import Board
+from gym_env.game.encoding import build_observations
 from gym_env.game.player import Player
+from gym_env.game.rules import RuleEvaluator, RulePiece
+
+# process-wide table of instantiated piece prototypes, keyed by the piece type configuration they were built from
+_PIECE_PROTOTYPES = {}
+
+
+def get_piece_prototypes(piece_types):
+    """Instantiate a prototype for each configured piece type. Prototypes are cached per process, so that each
+    configuration is only instantiated once, no matter how many games are created.
+
+    :param piece_types: dict or DictConfig mapping piece names to configs with a `_target_` class path.
+    :return: tuple of pieces without player and board, in the order of `piece_types`.
+    """
+    if not isinstance(piece_types, dict):
+        from omegaconf import OmegaConf
+        piece_types = OmegaConf.to_container(piece_types, resolve=True)
+
+    key = repr(piece_types)
+    if key not in _PIECE_PROTOTYPES:
+        from hydra.utils import instantiate
+        prototypes = []
+        for name, piece_type in piece_types.items():
+            piece = instantiate(piece_type, player=None, board=None)
+            # pieces without a class level name, e.g. rule pieces, are named after their config
+            if piece.name is None:
+                piece.name = name
+            prototypes.append(piece)
+        _PIECE_PROTOTYPES[key] = tuple(prototypes)
+    return _PIECE_PROTOTYPES[key]
 
 
 class ExpandoGame:
@@ -18,7 +47,8 @@ class ExpandoGame:
     same amount but as penalty.
     """
 
-    def __init__(self, grid_size, n_players, max_turns, final_reward, piece_types, seed=None):
+    def __init__(self, grid_size, n_players, max_turns, final_reward, piece_types, seed=None, sparse_board=False,
+                 metrics=None):
         """
 
         :param grid_size: the dimensions of the board.
@@ -27,6 +57,8 @@ class ExpandoGame:
         :param piece_types: list of sub-classes of Piece, that can be used in the game
         :param final_reward: the amount of reward that is either granted for winning or used as penalty for loosing
         :param seed: used to seed any random number generators
+        :param sparse_board: whether to use a sparse board, see `Board`.
+        :param metrics: optional GameMetrics that record the turns and finished episodes of the game.
         """
         self.np_random = default_rng(seed)
 
@@ -40,13 +72,16 @@ class ExpandoGame:
         self.max_turns = max_turns
         self.n_turns = 0
 
-        self.board = Board(grid_size, self)
+        prototypes = get_piece_prototypes(piece_types)
+        self.board = Board(grid_size, self, sparse=sparse_board)
+        if not sparse_board and any(isinstance(piece, RulePiece) for piece in prototypes):
+            self.board.rules = RuleEvaluator(prototypes, grid_size, n_players)
         self.players = [Player(i, self.board) for i in range(n_players)]
 
         self._init_player_positions()
-        self._action_pairs = None
-        self._id_to_piece = {i: instantiate(piece, player=None, board=None) for i, piece in
-                             enumerate(piece_types.values())}
+        self._actions = get_action_table(self.n_dims, len(self.name_to_id))
+        self._id_to_piece = dict(enumerate(prototypes))
+        self.metrics = metrics
 
     def _init_player_positions(self):
         """Place each player's cursor at a random position.
@@ -57,34 +92,35 @@ class ExpandoGame:
             cursors.add(cursor)
 
         for c, p in zip(cursors, self.players):
-            p.cursor = np.array(c, dtype=np.int64)
+            p.set_cursor(np.array(c, dtype=np.int64))
 
     def take_turn(self, action, player_id):
         """Perform a player's turn given an action.
 
-        :param action: the action the paler should take, encoded as integer.
+        :param action: the action the player should take, encoded as integer or as pair of integers.
         :param player_id: the player_id of the player that should perform the action.
         :return: the player's reward after performing the action.
         """
-        if not isinstance(action, list):
-            action = self._discrete_to_multidiscrete(action)
-
-        cursor_move, place_action = action
-        move_direction: np.ndarray = self._decode_action(cursor_move, 'cursor_move')
-        piece_id = self._decode_action(place_action, 'piece_type')
+        cursor_move, move_direction, piece_id = self._actions.decode(action)
 
         cur_player = self.players[player_id]
-        cur_player.move_cursor(move_direction)
-        if piece_id is not None:
+        moved = cursor_move and cur_player.move_cursor(move_direction)
+        placed = False
+        if piece_id:
             piece = self._get_piece(piece_id, cur_player)
-            cur_player.place_piece(piece)
+            placed = cur_player.place_piece(piece)
 
         reward = self.players[player_id].current_reward
         self.players[player_id].total_reward += reward
+        if self.metrics is not None:
+            self.metrics.record_turn(cur_player, cursor_move and not moved, piece if placed else None,
+                                     piece_id and not placed)
 
         # increase  counters
         for piece in self.all_pieces:
             piece.age += 1
+        if self.board.rules is not None:
+            self.board.rules.step()
         self.n_turns += 1
 
         if self.is_done:
@@ -98,23 +134,80 @@ class ExpandoGame:
                 reward -= self.final_reward
         return reward
 
+    def resize(self, grid_size, n_players):
+        """Change the board's dimensions and the number of players. The number of axes is fixed, since it determines the
+        actions. The current episode is discarded and the game has to be reset before the next turn. The metrics are
+        only cleared if the number of players changes.
+
+        :param grid_size: new dimensions of the board.
+        :param n_players: new number of players.
+        """
+        assert len(grid_size) == self.n_dims, 'the number of axes of the board can not be changed.'
+        if self.metrics is not None:
+            if n_players == self.metrics.n_players:
+                # a finished episode that was not reset yet is still recorded
+                self.metrics.end_episode(self.players, self.is_done)
+            else:
+                self.metrics.resize(n_players)
+        self.grid_size = grid_size
+        self.n_players = n_players
+        self.board.resize(grid_size, n_players)
+        self.n_turns = 0
+
     def reset(self):
-        """Reset the game's state and place the player's cursors at random positions.
+        """Reset the game's state and place the player's cursors at random positions. A finished episode is recorded by
+        the game's metrics.
         """
+        if self.metrics is not None:
+            self.metrics.end_episode(self.players, self.is_done)
         self.n_turns = 0
         self.board.reset_grid()
         self.players = [Player(i, self.board) for i in range(self.n_players)]
         self._init_player_positions()
 
-    def get_observation(self, player_id, formatting):
+    def get_observation(self, player_id, formatting, dtype=np.float64):
         """Return an observation from the perspective of a player, i.e. treating her as player 0.
 
         :param player_id: player_id of the player from who's perspective the game is observed.
-        :param formatting: 'flat' or 'grid' representation of the game. Where flat is a k-dimensional vector, and grid a
-        d_0 x ... x d_n dimensional tensor.
-        :return: the observation of the player encoded as numpy array.
+        :param formatting: 'flat', 'grid' or 'sparse' representation of the game. Where flat is a k-dimensional vector,
+        grid a d_0 x ... x d_n dimensional tensor and sparse a dict of the placed pieces' positions and codes.
+        :param dtype: dtype of 'flat' and 'grid' observations.
+        :return: the observation of the player encoded as numpy array, or a dict for 'sparse'.
+        """
+        return self.players[player_id].get_observation(formatting, dtype)
+
+    def get_all_observations(self, formatting, dtype=np.float64):
+        """Return the observations of all players at once, each from the perspective of the respective player.
+
+        :param formatting: 'flat', 'grid' or 'sparse' representation of the game, see `get_observation()`.
+        :param dtype: dtype of 'flat' and 'grid' observations.
+        :return: numpy array of shape (n_players, d_0, ..., d_n, n_channels) for 'grid' or (n_players, k) for 'flat'.
+        For 'sparse', a list of each player's observation.
+        """
+        if formatting == 'sparse':
+            return [player.get_sparse_observation() for player in self.players]
+
+        board = self.board
+        codes = board.all_permutations[:, board.dense_codes()]
+        cursors = np.stack([p.cursor for p in self.players])
+        populations = [p.population for p in self.players]
+        rooms = [p.room for p in self.players]
+        return build_observations(formatting, codes, cursors, populations, rooms, board.one_hot_dim, dtype=dtype)
+
+    def get_episode_stats(self, player_id):
+        """Summarize the current episode from the perspective of a player, usually called once the game is done.
+
+        :param player_id: id of the player to summarize the episode for.
+        :return: dict of scalar statistics.
         """
-        return self.players[player_id].get_observation(formatting)
+        player = self.players[player_id]
+        has_won = all([player.total_reward > p.total_reward for p in self.players if p is not player])
+        return {'population': player.population,
+                'room': player.room,
+                'happiness': player.happiness_penalty,
+                'total_reward': player.total_reward,
+                'n_pieces': len(player.pieces),
+                'win': float(has_won)}
 
     @property
     def is_done(self):
@@ -124,6 +217,20 @@ class ExpandoGame:
         """
         return self.board.is_full() or self.n_turns > self.max_turns
 
+    @property
+    def state_hash(self):
+        """Zobrist hash of the observable state, i.e. the board's codes and all players' cursors, populations and rooms,
+        which is everything that observations are built from. The board's part is maintained incrementally on each
+        placement and the cursors' on each move. Note that neither the turn count, nor piece ages and total rewards are
+        part of the hash.
+
+        :return: integer in [0, 2 ** 64).
+        """
+        state_hash = self.board.hash
+        for player in self.players:
+            state_hash ^= player.state_hash
+        return state_hash
+
     @property
     def all_pieces(self):
         """Get a list of all pieces that are currently placed on the board.
@@ -135,66 +242,6 @@ class ExpandoGame:
             all_pieces.extend(player.pieces)
         return all_pieces
 
-    def _decode_action(self, action, action_type):
-        """Factory method for decoding integer encoded actions based on the type of action.
-
-        :param action: integer encoding an action
-        :param action_type: either 'cursor_move' ir 'piece_type'.
-        :return: a decoded action.
-        """
-        if action_type == 'cursor_move':
-            return self._decode_cursor_move(action)
-        elif action_type == 'piece_type':
-            return self._decode_piece_type(action)
-        else:
-            raise NotImplementedError()
-
-    def _decode_cursor_move(self, action: int):
-        """Take an integer and return the corresponding direction vector for moving the cursor. The integer encoding
-        for a cursor move is within range [0, 2*n_dims] where 0 means no change in direction, 1 <= k <= n_dims means
-        +1 along the k-th dimension and n_dims+1 <= i <= 2*n_dims means -1 along the (i-n_dims)-th dimension.
-
-        :param action: integer representing cursor move
-        :return: direction vector to move to as a numpy array
-        """
-        assert action >= 0
-        assert 0 <= action <= 2 * self.n_dims, 'we can move in two directions for each axis or not move at all'
-
-        direction = np.zeros((self.n_dims,), dtype=np.int64)
-        if 0 < action <= self.n_dims:
-            # 1 to n_dimensions
-            direction[action - 1] += 1
-        elif self.n_dims < action <= 2 * self.n_dims:
-            # n_dimensions to 2 * n_dimensions
-            direction[(action + 1) % self.n_dims] -= 1
-        # else action=0, do nothing...
-
-        return direction
-
-    @staticmethod
-    def _decode_piece_type(action):
-        """Decode the correct piece type from an integer id.
-
-        :param action: integer id representing a piece type
-        :return: a piece object
-        """
-
-        return None if action is 0 else action
-
-    def _discrete_to_multidiscrete(self, action):
-        """Transform a discrete action into a multidiscrete action by looking up a corresponding action pair.
-
-        :param action: integer representing a multidiscrete action.
-        :return: a pair of integers, each representing an action.
-        """
-        if self._action_pairs is None:
-            move_directions = range(2 * self.n_dims + 1)
-            piece_types = range(len(self.name_to_id))
-
-            self._action_pairs = [(a_0, a_1) for a_0, a_1 in itertools.product(move_directions, piece_types)]
-
-        return self._action_pairs[action]
-
     def seed(self, seed=None):
         """Seed any random number generators. Note that pseudo random actions are performed at initialization, so in
         order to seed these actions as well you need to pass a seed to the constructor.
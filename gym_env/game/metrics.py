@@ -0,0 +1,183 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from gym_env.game.pieces import Farm
+from gym_env.game.rules import RulePiece
+
+
+class GameMetrics:
+    """Telemetry of the games played by an `ExpandoGame`, e.g. for monitoring long training runs.
+
+    During an episode, each player's turns only increment a few python counters. When a finished episode is reset, the
+    counters are written as one row per episode into fixed-size ring buffers, so the metrics cover the `capacity` most
+    recent episodes and their memory doesn't grow. Counters of episodes that are reset before they are done are dropped.
+
+    Per episode and seat, i.e. player id, the following counters are kept:
+        turns: number of turns taken.
+        placements: number of pieces placed.
+        failed_placements: number of pieces that could not be placed, since the cell was occupied.
+        noop_moves: number of cursor moves that were blocked by the board's edge.
+        penalty_turns: number of turns with a happiness penalty.
+        activations: number of farms, or latching rule pieces, that started generating reward.
+        activation_latency: sum of the ages of these pieces when they started generating reward.
+        wins: whether the seat won the episode.
+    """
+
+    fields = ('turns', 'placements', 'failed_placements', 'noop_moves', 'penalty_turns', 'activations',
+              'activation_latency', 'wins')
+
+    def __init__(self, n_players, capacity=1000, export_path=None, export_interval=None):
+        """
+
+        :param n_players: number of players in the game.
+        :param capacity: number of most recent episodes that are kept.
+        :param export_path: file that snapshots are appended to, see `export()`.
+        :param export_interval: number of finished episodes between snapshots written to `export_path`. No snapshots
+        are written periodically if None.
+        """
+        assert export_interval is None or export_path is not None, 'periodic snapshots require an export path.'
+        self.capacity = capacity
+        self.export_path = export_path
+        self.export_interval = export_interval
+        # total number of finished episodes, including the ones that were overwritten in the buffers
+        self.n_episodes = 0
+
+        self.n_players = None
+        self.buffers = None
+        self.pos = 0
+        self.full = False
+        self._counters = None
+        self.resize(n_players)
+
+    def resize(self, n_players):
+        """Change the number of players, which clears the buffers.
+
+        :param n_players: new number of players.
+        """
+        self.n_players = n_players
+        self.buffers = {name: np.zeros((self.capacity, n_players), dtype=np.int64) for name in self.fields}
+        self.pos = 0
+        self.full = False
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self._counters = {name: [0] * self.n_players for name in self.fields}
+        # the counters updated each turn, as attributes to avoid the lookups
+        self._turns, self._placements, self._failed_placements, self._noop_moves, self._penalty_turns = \
+            [self._counters[name] for name in self.fields[:5]]
+        # farms and latching rule pieces of each player that did not generate reward yet
+        self._pending_farms = [[] for _ in range(self.n_players)]
+        self._pending_rules = [[] for _ in range(self.n_players)]
+
+    def record_turn(self, player, move_blocked, placed_piece, placement_failed):
+        """Record a player's turn, after its reward was computed.
+
+        :param player: the player that took the turn.
+        :param move_blocked: whether a cursor move was blocked by the board's edge.
+        :param placed_piece: the piece placed in this turn, or None.
+        :param placement_failed: whether placing a piece failed.
+        """
+        player_id = player.player_id
+        self._turns[player_id] += 1
+        if move_blocked:
+            self._noop_moves[player_id] += 1
+        if placement_failed:
+            self._failed_placements[player_id] += 1
+        if player.room < player.population:
+            self._penalty_turns[player_id] += 1
+
+        if placed_piece is not None:
+            self._placements[player_id] += 1
+            if isinstance(placed_piece, Farm):
+                self._pending_farms[player_id].append(placed_piece)
+            elif isinstance(placed_piece, RulePiece) and placed_piece.latch:
+                self._pending_rules[player_id].append(placed_piece)
+
+        # pieces only start generating reward in their owner's turn
+        farms = self._pending_farms[player_id]
+        if farms and any(farm.generates_reward for farm in farms):
+            self._pending_farms[player_id] = self._activate(player_id, farms, [f.generates_reward for f in farms])
+        pieces = self._pending_rules[player_id]
+        if pieces:
+            # rule pieces are latched by the board's rule evaluator on dense boards
+            rules = player.board.rules
+            is_latched = [bool(rules.is_latched[tuple(piece.position)]) if rules is not None else piece.is_latched
+                          for piece in pieces]
+            if any(is_latched):
+                self._pending_rules[player_id] = self._activate(player_id, pieces, is_latched)
+
+    def _activate(self, player_id, pieces, is_activated):
+        """Count the activated pieces and their latency.
+
+        :return: the pieces that are not activated yet.
+        """
+        activated = [piece for piece, active in zip(pieces, is_activated) if active]
+        self._counters['activations'][player_id] += len(activated)
+        self._counters['activation_latency'][player_id] += sum(piece.age for piece in activated)
+        return [piece for piece, active in zip(pieces, is_activated) if not active]
+
+    def end_episode(self, players, is_done):
+        """Write the counters of the current episode into the buffers and start a new episode.
+
+        :param players: the players of the episode.
+        :param is_done: whether the episode is finished. Counters of unfinished episodes are dropped.
+        """
+        if is_done:
+            counters = self._counters
+            for player in players:
+                counters['wins'][player.player_id] = int(all(player.total_reward > p.total_reward
+                                                             for p in players if p is not player))
+            for name, buffer in self.buffers.items():
+                buffer[self.pos] = counters[name]
+            self.pos = (self.pos + 1) % self.capacity
+            self.full = self.full or self.pos == 0
+            self.n_episodes += 1
+
+            if self.export_interval is not None and self.n_episodes % self.export_interval == 0:
+                self.export(self.export_path)
+        self._reset_counters()
+
+    def get_episodes(self):
+        """Get the buffered episodes in the order they were played.
+
+        :return: dict mapping each field to an array of shape (n_buffered_episodes, n_players).
+        """
+        if self.full:
+            return {name: np.roll(buffer, -self.pos, axis=0) for name, buffer in self.buffers.items()}
+        return {name: buffer[:self.pos].copy() for name, buffer in self.buffers.items()}
+
+    def summary(self):
+        """Summarize the buffered episodes per seat.
+
+        :return: dict with the number of buffered episodes and, as lists per seat, the rates of placements, failed
+        placements, no-op moves and turns with happiness penalty per turn, the mean activation latency in turns (NaN
+        without activations) and the win rate.
+        """
+        totals = {name: buffer.sum(axis=0) for name, buffer in self.buffers.items()}
+        n_buffered = self.capacity if self.full else self.pos
+        turns = np.maximum(totals['turns'], 1)
+        activations = totals['activations']
+        latency = np.where(activations > 0, totals['activation_latency'] / np.maximum(activations, 1), np.nan)
+        return {'n_episodes': n_buffered,
+                'placement_rate': (totals['placements'] / turns).tolist(),
+                'failed_placement_rate': (totals['failed_placements'] / turns).tolist(),
+                'noop_move_rate': (totals['noop_moves'] / turns).tolist(),
+                'penalty_rate': (totals['penalty_turns'] / turns).tolist(),
+                'activation_latency': latency.tolist(),
+                'win_rate': (totals['wins'] / max(n_buffered, 1)).tolist()}
+
+    def export(self, path):
+        """Append a snapshot of the summary as a line of json to a file. Snapshots hold the time, the process id and the
+        total number of finished episodes, so several environments can share a file.
+
+        :param path: path of the file, its directory is created if it does not exist.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        snapshot = {'time': time.time(), 'pid': os.getpid(), 'total_episodes': self.n_episodes, **self.summary()}
+        with open(path, 'a') as fp:
+            fp.write(json.dumps(snapshot) + '\n')
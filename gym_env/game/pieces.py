@@ -2,7 +2,6 @@ import itertools
 from abc import ABC, abstractmethod
 
 import numpy as np
-from pyglet.shapes import Rectangle
 
 
 class Piece(ABC):
@@ -49,6 +48,8 @@ class Piece(ABC):
         :param color: color the piece should have.
         :return: a drawable pyglet object that holds a reference/was added to `batch`.
         """
+        from pyglet.shapes import Rectangle
+
         r = Rectangle(x, y,
                       square_size, square_size,
                       color=color,
@@ -65,6 +66,8 @@ class Empty(Piece):
         return 0
 
     def to_drawable(self, x, y, batch, square_size, color):
+        from pyglet.shapes import Rectangle
+
         r = Rectangle(x, y,
                       square_size, square_size,
                       color=(10, 10, 10),
@@ -96,6 +99,8 @@ class City(Piece):
     def to_drawable(self, x, y, batch, square_size, color):
         """A city is represented as square containing a smaller square.
         """
+        from pyglet.shapes import Rectangle
+
         shapes = []
         r = super().to_drawable(x, y, batch, square_size, color)
         shapes.append(r)
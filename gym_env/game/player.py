@@ -1,5 +1,9 @@
 import numpy as np
 
+from gym_env.game.encoding import grid_observations, flat_observations, codes_to_one_hot
+from gym_env.game.rules import RulePiece
+from gym_env.game.zobrist import cursor_key, scalars_key
+
 
 class Player:
     """A Player can have a list of associated pieces set on a board. To set pieces, the player has a cursor that can
@@ -14,8 +18,13 @@ class Player:
         """
         self.player_id = player_id
         self.pieces = []
+        # pieces whose reward is computed by calling `turn_reward()`, i.e. all pieces that aren't compiled rule pieces
+        self._scripted_pieces = []
         self.board = board
-        self.cursor = np.zeros(len(self.board.grid_size))
+        self.cursor = None
+        # zobrist hash of the cursor position, see `zobrist.py`
+        self.cursor_hash = 0
+        self.set_cursor(np.zeros(len(self.board.grid_size)))
 
         # game stats
         self.room = 0
@@ -37,9 +46,25 @@ class Player:
         """Move the player's cursor by adding a direction vector.
 
         :param direction: an offset vector that is added to the current cursor position if it describes a legal move.
+        :return: whether the cursor was moved, i.e. the move was legal.
+        :rtype: bool
         """
-        if self.board.is_within_grid(self.cursor + direction):
-            self.cursor += direction
+        # the cursor is moved in place and moved back if it left the board, the hash is only updated for legal moves
+        self.cursor += direction
+        if self.board.is_within_grid(self.cursor):
+            previous_key = cursor_key(self.player_id, self.cursor - direction)
+            self.cursor_hash ^= previous_key ^ cursor_key(self.player_id, self.cursor)
+            return True
+        self.cursor -= direction
+        return False
+
+    def set_cursor(self, position):
+        """Place the player's cursor at a position.
+
+        :param position: the new cursor position.
+        """
+        self.cursor = position
+        self.cursor_hash = cursor_key(self.player_id, position)
 
     def place_piece(self, piece):
         """Place a piece on the board at the current cursor position of the player.
@@ -52,56 +77,105 @@ class Player:
         success = self.board.place_piece(piece, tuple(self.cursor))
         if success:
             self.pieces.append(piece)
+            if self.board.rules is None or not isinstance(piece, RulePiece):
+                self._scripted_pieces.append(piece)
             piece.at_placement()
         return success
 
-    def get_observation(self, formatting):
+    def get_observation(self, formatting, dtype=np.float64):
         """Get an observation from the player's perspective encoded as numpy array.
 
-        :param formatting: 'flat' or 'grid', whether to return the observations as flat vector or as tensor.
-        :return: a numpy array representing an observation.
+        :param formatting: 'flat', 'grid' or 'sparse', whether to return the observations as flat vector, as tensor or
+        as dict of sparse coordinate/value lists.
+        :param dtype: dtype of 'flat' and 'grid' observations.
+        :return: a numpy array representing an observation, or a dict for 'sparse'.
         """
         if formatting == 'grid':
-            return self.get_grid_observation()
+            return self.get_grid_observation(dtype)
         elif formatting == 'flat':
-            return self.get_flat_observation()
+            return self.get_flat_observation(dtype)
+        elif formatting == 'sparse':
+            return self.get_sparse_observation()
 
-    def get_grid_observation(self):
+    def get_grid_observation(self, dtype=np.float64):
         """Get the player's observation of the board as multidimensional tensor.
 
+        :param dtype: dtype of the observation.
         :return: a multidimensional numpy array
         """
-        cursor_bit = np.zeros(self.board.grid_size + (1,))
-        cursor_bit[tuple(self.cursor)] = 1
-
-        n_grid = np.prod(self.board.grid_size)
-        population_normalized = np.full(cursor_bit.shape, self.population / n_grid)
-        room_normalized = np.full(cursor_bit.shape, self.room / n_grid)
-
-        obs = np.concatenate([
-            self.board.to_one_hot(self.player_id),
-            cursor_bit,
-            population_normalized,
-            room_normalized
-        ], axis=-1)
-        return obs
-
-    def get_flat_observation(self):
+        obs = grid_observations(*self._observation_args(), dtype=dtype)
+        return obs[0]
+
+    def get_flat_observation(self, dtype=np.float64):
         """Get the player's observation of the board as flat vector.
 
+        :param dtype: dtype of the observation.
         :return: a 1D numpy array.
         """
-        grid = self.board.to_one_hot(self.player_id).ravel()
-        cursor_normalized = self.cursor / np.array(self.board.grid_size)
+        # stable baseline policies expect a batch dimension
+        return flat_observations(*self._observation_args(), dtype=dtype)
 
-        n_grid = np.prod(self.board.grid_size)
-        population_normalized = np.array([self.population / n_grid])
-        room_normalized = np.array([self.room / n_grid])
+    def get_sparse_observation(self):
+        """Get the player's observation as lists of the placed pieces' positions and codes, where a code is the index
+        of the piece's one-hot encoding. Its size only depends on the number of placed pieces.
 
-        obs = np.concatenate([grid, cursor_normalized, population_normalized, room_normalized])
+        :return: a dict with 'positions' of shape (n_pieces, n_dims), 'codes' of shape (n_pieces,), the 'cursor'
+        position and the normalized 'scalars' (population, room).
+        """
+        positions, codes = self.board.sparse_codes(self.player_id)
+        n_grid = self.board.n_cells
+        return {'positions': positions,
+                'codes': codes,
+                'cursor': self.cursor.copy(),
+                'scalars': np.array([self.population / n_grid, self.room / n_grid])}
+
+    def get_window_observation(self, window_size, formatting, summary_factor=None, dtype=np.float64):
+        """Get the player's observation of a window of cells centered on the cursor, so its size does not depend on the
+        board's size. Cells are one-hot encoded with an additional last channel that marks cells outside of the board.
+
+        :param window_size: number of cells along each axis of the window.
+        :param formatting: 'grid' for a tensor of shape (*window_size, n_one_hot + 1 + 2) with population and room as
+        additional channels, 'flat' for a vector that also contains the normalized cursor position.
+        :param summary_factor: if given, a summary of the whole board is appended to 'flat' observations, i.e. the
+        one-hot encodings average pooled over blocks of summary_factor cells along each axis.
+        :param dtype: dtype of the observation.
+        :return: a numpy array
+        """
+        board = self.board
+        one_hot_dim = board.one_hot_dim
+        # the outside code is kept as is
+        permutation = np.append(board.permutation(self.player_id), one_hot_dim)
+        window = codes_to_one_hot(board.window_codes(self.cursor, window_size), one_hot_dim + 1, permutation, dtype)
+
+        n_grid = board.n_cells
+        scalars = np.array([self.population / n_grid, self.room / n_grid])
+        if formatting == 'grid':
+            assert summary_factor is None, 'a global summary is only supported for flat observations.'
+            scalar_planes = np.broadcast_to(scalars, window.shape[:-1] + scalars.shape)
+            return np.concatenate([window, scalar_planes], axis=-1).astype(dtype, copy=False)
+
+        parts = [window.ravel(), self.cursor / np.array(board.grid_size), scalars]
+        if summary_factor is not None:
+            summary = board.pooled_one_hot(summary_factor, self.player_id, dtype)
+            parts.append(summary.ravel())
         # stable baseline policies expect a batch dimension
-        obs = obs.reshape(1, -1)
-        return obs
+        return np.concatenate(parts).astype(dtype, copy=False).reshape(1, -1)
+
+    def _observation_args(self):
+        """Collect the state that an observation is built from, as a batch of size 1.
+
+        :return: arguments for the functions in `encoding`.
+        """
+        return (self.board.dense_codes()[None], self.cursor[None], [self.population], [self.room],
+                self.board.one_hot_dim, self.board.permutation(self.player_id))
+
+    @property
+    def state_hash(self):
+        """Zobrist hash of the player's cursor, population and room.
+
+        :return: integer in [0, 2 ** 64).
+        """
+        return self.cursor_hash ^ scalars_key(self.player_id, self.population, self.room)
 
     @property
     def happiness_penalty(self):
@@ -117,5 +191,7 @@ class Player:
 
         :return: the numerical reward
         """
-        turn_rewards = sum([piece.turn_reward() for piece in self.pieces])
+        turn_rewards = sum([piece.turn_reward() for piece in self._scripted_pieces])
+        if self.board.rules is not None:
+            turn_rewards += self.board.rules.reward(self.board.codes, self.player_id)
         return turn_rewards + self.happiness_penalty
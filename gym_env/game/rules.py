@@ -0,0 +1,229 @@
+"""Declarative piece rules, for adding piece types through the piece type config instead of Piece subclasses.
+
+A rule piece is configured like any other piece type, e.g.
+
+    market:
+      _target_: gym_env.game.rules.RulePiece
+      reward: 0.3           # reward per turn while the piece is active
+      delay: 5              # minimum age of the piece before it can become active
+      latch: False          # whether the piece stays active once it has been active
+      population: 0         # population added to the owner when the piece is placed
+      room: 0               # room added to the owner when the piece is placed
+      conditions:           # conditions on the neighbors, that all need to hold for the piece to become active
+        - neighbor: city    # name, or list of names, of the neighboring piece types that are counted
+          owner: self       # 'self', 'other' or 'any', whose neighboring pieces are counted
+          diagonal: False   # whether diagonal neighbors are counted
+          min_count: 1      # minimum number of counted neighbors, defaults to 1, or to 0 if max_count is set
+          max_count: null   # maximum number of counted neighbors, unbounded if null
+
+On dense boards, the rules of all rule piece types are compiled once into a `RuleEvaluator`, which computes the reward
+of all rule pieces of a player with array operations over the whole board, instead of a python call per piece. On
+sparse boards, each piece evaluates its rule on its own, with the same results.
+`experiments/config/env/expando_rules.yaml` configures the built-in farm and city as rule pieces, together with a
+market piece.
+"""
+import itertools
+from functools import lru_cache
+
+import numpy as np
+
+from gym_env.game.pieces import Piece
+
+OWNERS = ('self', 'other', 'any')
+
+
+@lru_cache(maxsize=None)
+def neighbor_offsets(n_dims, diagonal):
+    """Get the offsets from a cell to its neighbors.
+
+    :param n_dims: number of axes of the board.
+    :param diagonal: whether to include diagonal neighbors.
+    :return: tuple of offset tuples.
+    """
+    if diagonal:
+        return tuple(o for o in itertools.product((-1, 0, 1), repeat=n_dims) if any(o))
+    return tuple(tuple(step if i == axis else 0 for i in range(n_dims)) for axis in range(n_dims) for step in (-1, 1))
+
+
+class RulePiece(Piece):
+    """A piece whose behavior is defined by a declarative rule, see the module's docstring. The name of the piece type
+    is taken from the key of its config.
+    """
+
+    def __init__(self, player, board, reward=0.0, delay=0, latch=False, population=0, room=0, conditions=()):
+        """
+
+        :param reward: reward per turn while the piece is active.
+        :param delay: minimum age of the piece before it can become active.
+        :param latch: whether the piece stays active once it has been active.
+        :param population: population added to the owner when the piece is placed.
+        :param room: room added to the owner when the piece is placed.
+        :param conditions: list of dicts with the keys 'neighbor', 'owner', 'diagonal', 'min_count' and 'max_count',
+        see the module's docstring.
+        """
+        super().__init__(player, board)
+        self.reward = reward
+        self.delay = delay
+        self.latch = latch
+        self.population = population
+        self.room = room
+        self.conditions = tuple(self._parse_condition(condition) for condition in conditions)
+        self.is_latched = False
+
+    @staticmethod
+    def _parse_condition(condition):
+        condition = dict(condition)
+        neighbor = condition.pop('neighbor')
+        parsed = {'neighbors': (neighbor,) if isinstance(neighbor, str) else tuple(neighbor),
+                  'owner': condition.pop('owner', 'any'),
+                  'diagonal': condition.pop('diagonal', False),
+                  'max_count': condition.pop('max_count', None)}
+        parsed['min_count'] = condition.pop('min_count', 1 if parsed['max_count'] is None else 0)
+        assert not condition, f'unknown keys {list(condition)} in piece rule condition.'
+        assert parsed['owner'] in OWNERS, f'owner needs to be one of {OWNERS}.'
+        return parsed
+
+    def turn_reward(self):
+        """Evaluate the rule for this piece alone, used on sparse boards.
+
+        :return: the reward if the piece is active, 0 otherwise.
+        """
+        if self.is_latched:
+            return self.reward
+        if self.age < self.delay or not all(self._holds(condition) for condition in self.conditions):
+            return 0
+        self.is_latched = self.latch
+        return self.reward
+
+    def _holds(self, condition):
+        count = 0
+        for offset in neighbor_offsets(len(self.position), condition['diagonal']):
+            position = tuple(self.position + offset)
+            if not self.board.is_within_grid(position):
+                continue
+            piece = self.board.get_piece(position)
+            if piece.name not in condition['neighbors']:
+                continue
+            if piece is self.board.empty_field or condition['owner'] == 'any' or \
+                    (piece.player is self.player) == (condition['owner'] == 'self'):
+                count += 1
+        max_count = condition['max_count']
+        return count >= condition['min_count'] and (max_count is None or count <= max_count)
+
+    def at_placement(self):
+        """Add the piece's population and room to its owner.
+        """
+        self.player.population += self.population
+        self.player.room += self.room
+
+
+class RuleEvaluator:
+    """Board-level evaluator of the rules of all rule piece types of a game. It keeps the turn in which each cell's
+    piece was placed and which pieces are latched, and computes the rewards of a player's rule pieces with array
+    operations.
+    """
+
+    def __init__(self, prototypes, grid_size, n_players):
+        """
+
+        :param prototypes: piece prototypes in the order of the piece ids, see `get_piece_prototypes()`.
+        :param grid_size: dimensions of the board.
+        :param n_players: number of players.
+        """
+        name_to_id = {piece.name: piece_id for piece_id, piece in enumerate(prototypes)}
+        self.n_piece_types = len(prototypes) - 1
+        # compiled rules as (piece_id, reward, delay, latch, conditions), with the neighbor names mapped to ids
+        self.rules = []
+        for piece_id, piece in enumerate(prototypes):
+            # pieces that neither generate reward nor latch don't need to be evaluated
+            if not isinstance(piece, RulePiece) or (piece.reward == 0 and not piece.latch):
+                continue
+            conditions = []
+            for condition in piece.conditions:
+                unknown = set(condition['neighbors']) - set(name_to_id)
+                assert not unknown, f'unknown piece types {unknown} in the rule of {piece.name}.'
+                neighbor_ids = np.array([name_to_id[name] for name in condition['neighbors']])
+                conditions.append((neighbor_ids, condition['owner'], condition['diagonal'], condition['min_count'],
+                                   condition['max_count']))
+            self.rules.append((piece_id, piece.reward, piece.delay, piece.latch, conditions))
+
+        self.n_turns = 0
+        self.placed_turn = None
+        self.is_latched = None
+        self._piece_ids = None
+        self._owners = None
+        self.resize(grid_size, n_players)
+
+    def resize(self, grid_size, n_players):
+        """Change the board's dimensions and the number of players, and reset the evaluator.
+        """
+        codes = np.arange(1 + n_players * self.n_piece_types)
+        # piece id and owner of each code, the empty field has no owner
+        self._piece_ids = np.where(codes == 0, 0, (codes - 1) % self.n_piece_types + 1)
+        self._owners = np.where(codes == 0, -1, (codes - 1) // self.n_piece_types)
+        self.placed_turn = np.zeros(grid_size, dtype=np.int64)
+        self.is_latched = np.zeros(grid_size, dtype=bool)
+        self.reset()
+
+    def reset(self):
+        self.n_turns = 0
+        self.placed_turn[...] = 0
+        self.is_latched[...] = False
+
+    def place(self, position):
+        """Record the placement of a piece.
+
+        :param position: position of the placed piece.
+        """
+        self.placed_turn[position] = self.n_turns
+
+    def step(self):
+        """Age all pieces by one turn.
+        """
+        self.n_turns += 1
+
+    def reward(self, codes, player_id):
+        """Compute the total reward of a player's rule pieces and latch the pieces that became active.
+
+        :param codes: dense codes of the board.
+        :param player_id: id of the player.
+        :return: the reward.
+        """
+        reward = 0.0
+        piece_ids, owners = None, None
+        for piece_id, piece_reward, delay, latch, conditions in self.rules:
+            pieces = codes == piece_id + self.n_piece_types * player_id
+            if not pieces.any():
+                continue
+
+            active = pieces & (self.n_turns - self.placed_turn >= delay)
+            if conditions and piece_ids is None:
+                piece_ids, owners = self._piece_ids[codes], self._owners[codes]
+            for neighbor_ids, owner, diagonal, min_count, max_count in conditions:
+                if not active.any():
+                    break
+                counted = np.isin(piece_ids, neighbor_ids)
+                if owner == 'self':
+                    counted &= (owners == player_id) | (codes == 0)
+                elif owner == 'other':
+                    counted &= owners != player_id
+                count = self._count_neighbors(counted, diagonal)
+                active &= count >= min_count
+                if max_count is not None:
+                    active &= count <= max_count
+
+            if latch:
+                active |= pieces & self.is_latched
+                self.is_latched |= active
+            reward += piece_reward * np.count_nonzero(active)
+        return reward
+
+    @staticmethod
+    def _count_neighbors(mask, diagonal):
+        """Count the neighbors of each cell that are in `mask`, cells outside of the board are not counted.
+        """
+        padded = np.pad(mask, 1)
+        count = np.zeros(mask.shape, dtype=np.int64)
+        for offset in neighbor_offsets(mask.ndim, diagonal):
+            count += padded[tuple(slice(1 + o, 1 + o + d) for o, d in zip(offset, mask.shape))]
+        return count
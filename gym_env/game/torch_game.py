@@ -0,0 +1,252 @@
+"""A batch of Expando games, whose whole state lives in CPU torch tensors.
+
+`TorchExpandoGame` plays `n_games` games in lockstep and implements the rules of the built-in `Farm` and `City` pieces
+with tensor operations over all boards at once, instead of per-piece python calls. Observations are built from the
+state tensors directly, so a torch policy can consume them without copies or dtype conversions, and the tensor kernels
+release the GIL while they run.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from gym_env.game.actions import get_action_table
+from gym_env.game.encoding import perspective_permutation
+from gym_env.game.game import get_piece_prototypes
+from gym_env.game.pieces import City, Empty, Farm
+
+
+class TorchExpandoGame:
+    """Batched counterpart of `ExpandoGame`. All games take turns in lockstep, i.e. `take_turn()` performs the turn of
+    the same player in every game. Games that are done need to be reset before the next turn, e.g. with
+    `game.reset(game.is_done)`.
+
+    State tensors, where B = n_games and P = n_players:
+        codes: (B, d_0, ..., d_n) categorical codes of the cells, see `Board.piece_code()`.
+        placed_turn: (B, d_0, ..., d_n) turn in which the piece of a cell was placed.
+        cursors: (B, P, n_dims) cursor positions.
+        populations, rooms, total_rewards: (B, P) player statistics.
+        n_turns: (B,) number of turns taken.
+
+    Only piece types that are `Empty`, `Farm` or `City` (or subclasses without changed rules) are supported. Their
+    parameters are read from the piece type config. A farm that once had an adjacent city of its owner keeps generating
+    reward, and since pieces are never removed, that is the case whenever it has one and is old enough. So no latch
+    state is needed.
+    """
+
+    def __init__(self, grid_size, n_players, max_turns, final_reward, piece_types, n_games=1, seed=None):
+        """
+
+        :param grid_size: the dimensions of the boards.
+        :param n_players: number of players participating in each game.
+        :param max_turns: the maximum number of turns that a game is allowed to last. Each player's turn is counted.
+        :param final_reward: the amount of reward that is either granted for winning or used as penalty for loosing.
+        :param piece_types: dict config of the piece types, see `ExpandoGame`.
+        :param n_games: number of games played in parallel.
+        :param seed: seed for the initial cursor positions.
+        """
+        self.grid_size = tuple(grid_size)
+        self.n_dims = len(self.grid_size)
+        self.n_cells = int(np.prod(self.grid_size))
+        self.n_players = n_players
+        self.max_turns = max_turns
+        self.final_reward = final_reward
+        self.n_games = n_games
+        self.generator = torch.Generator()
+        self.seed(seed)
+
+        prototypes = get_piece_prototypes(piece_types)
+        self.name_to_id = {name: i for i, name in enumerate(piece_types.keys())}
+        self.n_piece_types = len(prototypes)
+        self.one_hot_dim = 1 + n_players * (self.n_piece_types - 1)
+        self._compile_pieces(prototypes)
+
+        # lookup tables from discrete actions to (cursor move, piece id) and from cursor moves to direction vectors
+        actions = get_action_table(self.n_dims, self.n_piece_types)
+        self._action_moves = torch.tensor(actions.moves)
+        self._action_pieces = torch.tensor(actions.piece_ids)
+        self._directions = torch.tensor(actions.directions)
+        self._grid_size = torch.tensor(self.grid_size)
+        self._strides = torch.tensor([int(np.prod(self.grid_size[i + 1:])) for i in range(self.n_dims)])
+        self._permutations = torch.from_numpy(np.stack(
+            [perspective_permutation(i, n_players, self.n_piece_types - 1) for i in range(n_players)]))
+
+        self.codes = torch.zeros((n_games,) + self.grid_size, dtype=torch.int64)
+        self.placed_turn = torch.zeros((n_games,) + self.grid_size, dtype=torch.int64)
+        self.cursors = torch.zeros(n_games, n_players, self.n_dims, dtype=torch.int64)
+        self.populations = torch.zeros(n_games, n_players, dtype=torch.float64)
+        self.rooms = torch.zeros(n_games, n_players, dtype=torch.float64)
+        self.total_rewards = torch.zeros(n_games, n_players, dtype=torch.float64)
+        self.n_turns = torch.zeros(n_games, dtype=torch.int64)
+        self.n_placed = torch.zeros(n_games, dtype=torch.int64)
+        self.reset()
+
+    def _compile_pieces(self, prototypes):
+        """Collect the parameters of each piece type into lookup tensors indexed by piece id.
+        """
+        self._population_increase = torch.zeros(self.n_piece_types, dtype=torch.float64)
+        self._room_capacity = torch.zeros(self.n_piece_types, dtype=torch.float64)
+        self._farms = []
+        self._city_ids = []
+        for piece_id, piece in enumerate(prototypes):
+            if isinstance(piece, Farm):
+                self._population_increase[piece_id] = piece.population_increase
+                self._farms.append((piece_id, piece.reward_size, piece.reward_delay, piece.ignore_diagonal))
+            elif isinstance(piece, City):
+                self._room_capacity[piece_id] = piece.room_capacity
+                self._city_ids.append(piece_id)
+            else:
+                assert isinstance(piece, Empty), f'piece type {piece.name} is not supported by TorchExpandoGame.'
+
+    def seed(self, seed=None):
+        """Seed the generator of the initial cursor positions.
+
+        :param seed: the seed to set.
+        """
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def reset(self, mask=None):
+        """Reset games and place the player's cursors at random, distinct positions.
+
+        :param mask: boolean tensor of shape (n_games,) selecting the games to reset. Resets all games if None.
+        """
+        if mask is None:
+            mask = torch.ones(self.n_games, dtype=torch.bool)
+        n_reset = int(mask.sum())
+        self.codes[mask] = 0
+        self.placed_turn[mask] = 0
+        self.populations[mask] = 0
+        self.rooms[mask] = 0
+        self.total_rewards[mask] = 0
+        self.n_turns[mask] = 0
+        self.n_placed[mask] = 0
+
+        cells = torch.rand(n_reset, self.n_cells, generator=self.generator).argsort(dim=1)[:, :self.n_players]
+        self.cursors[mask] = self._unravel(cells)
+
+    def take_turn(self, actions, player_id):
+        """Perform the turn of a player in every game.
+
+        :param actions: int64 tensor of shape (n_games,) with discrete actions, or (n_games, 2) with (cursor move,
+        piece id) pairs.
+        :param player_id: the player that acts.
+        :return: float64 tensor of shape (n_games,) holding the player's rewards, including the final reward or penalty
+        in games that ended with this turn.
+        """
+        actions = torch.as_tensor(actions, dtype=torch.int64)
+        if actions.dim() == 1:
+            moves, piece_ids = self._action_moves[actions], self._action_pieces[actions]
+        else:
+            moves, piece_ids = actions[:, 0], actions[:, 1]
+
+        # move the cursors, if they stay on the board
+        cursors = self.cursors[:, player_id]
+        moved = cursors + self._directions[moves]
+        is_legal = ((moved >= 0) & (moved < self._grid_size)).all(dim=1)
+        cursors = torch.where(is_legal[:, None], moved, cursors)
+        self.cursors[:, player_id] = cursors
+
+        # place pieces on free cells
+        cells = (cursors * self._strides).sum(dim=1)
+        flat_codes = self.codes.view(self.n_games, -1)
+        is_placed = (piece_ids != 0) & (flat_codes.gather(1, cells[:, None])[:, 0] == 0)
+        games = is_placed.nonzero()[:, 0]
+        flat_codes[games, cells[games]] = piece_ids[games] + (self.n_piece_types - 1) * player_id
+        self.placed_turn.view(self.n_games, -1)[games, cells[games]] = self.n_turns[games]
+        self.n_placed += is_placed
+        self.populations[:, player_id] += is_placed * self._population_increase[piece_ids]
+        self.rooms[:, player_id] += is_placed * self._room_capacity[piece_ids]
+
+        rewards = self.current_rewards(player_id)
+        self.total_rewards[:, player_id] += rewards
+        self.n_turns += 1
+
+        # final reward or penalty, depending on whether the player did win or lose
+        others = torch.arange(self.n_players) != player_id
+        has_won = (self.total_rewards[:, player_id:player_id + 1] > self.total_rewards[:, others]).all(dim=1)
+        final_rewards = torch.where(has_won, torch.tensor(float(self.final_reward), dtype=torch.float64),
+                                    torch.tensor(-float(self.final_reward), dtype=torch.float64))
+        return rewards + self.is_done * final_rewards
+
+    def current_rewards(self, player_id):
+        """The rewards that a player receives given the boards' current constellations, see `Player.current_reward`.
+
+        :param player_id: id of the player.
+        :return: float64 tensor of shape (n_games,)
+        """
+        offset = (self.n_piece_types - 1) * player_id
+        owned_cities = torch.zeros_like(self.codes, dtype=torch.bool)
+        for city_id in self._city_ids:
+            owned_cities |= self.codes == city_id + offset
+
+        rewards = torch.zeros(self.n_games, dtype=torch.float64)
+        ages = self.n_turns.view((-1,) + (1,) * self.n_dims) - self.placed_turn
+        for farm_id, reward_size, reward_delay, ignore_diagonal in self._farms:
+            generates_reward = (self.codes == farm_id + offset) & (ages >= reward_delay) & \
+                               self._is_adjacent(owned_cities, ignore_diagonal)
+            rewards += reward_size * generates_reward.view(self.n_games, -1).sum(dim=1)
+
+        happiness_penalty = (self.rooms[:, player_id] - self.populations[:, player_id]).clamp(max=0)
+        return rewards + happiness_penalty
+
+    @property
+    def is_done(self):
+        """Whether the games have reached a terminal state.
+
+        :return: bool tensor of shape (n_games,)
+        """
+        return (self.n_placed >= self.n_cells) | (self.n_turns > self.max_turns)
+
+    def get_observations(self, player_id, formatting, dtype=torch.float32):
+        """Build the observations of a player in all games, in the same layout as `ExpandoGame.get_observation()`.
+
+        :param player_id: id of the observing player.
+        :param formatting: 'flat' or 'grid'.
+        :param dtype: dtype of the observations.
+        :return: tensor of shape (n_games, d_0, ..., d_n, one_hot_dim + 3) for 'grid', or (n_games, d_0 * ... * d_n *
+        one_hot_dim + n_dims + 2) for 'flat'.
+        """
+        one_hots = F.one_hot(self._permutations[player_id][self.codes], self.one_hot_dim).to(dtype)
+        cursors = self.cursors[:, player_id]
+        scalars = torch.stack([self.populations[:, player_id], self.rooms[:, player_id]], dim=1) / self.n_cells
+
+        if formatting == 'grid':
+            cursor_plane = torch.zeros(self.codes.shape, dtype=dtype)
+            cursor_plane.view(self.n_games, -1)[torch.arange(self.n_games), (cursors * self._strides).sum(dim=1)] = 1
+            scalar_planes = scalars.to(dtype).view((self.n_games,) + (1,) * self.n_dims + (2,))
+            scalar_planes = scalar_planes.expand(self.codes.shape + (2,))
+            return torch.cat([one_hots, cursor_plane[..., None], scalar_planes], dim=-1)
+        elif formatting == 'flat':
+            return torch.cat([one_hots.view(self.n_games, -1),
+                              (cursors / self._grid_size.to(torch.float64)).to(dtype),
+                              scalars.to(dtype)], dim=1)
+        raise NotImplementedError()
+
+    def _unravel(self, cells):
+        """Convert flat cell indices into positions.
+
+        :param cells: int64 tensor of flat indices.
+        :return: int64 tensor of shape cells.shape + (n_dims,)
+        """
+        return torch.stack([(cells // stride) % size for stride, size in zip(self._strides.tolist(), self.grid_size)],
+                           dim=-1)
+
+    def _is_adjacent(self, mask, ignore_diagonal):
+        """Mark the cells that have a neighbor in `mask`, either along the axes only or including diagonals.
+
+        :param mask: bool tensor of shape (n_games, d_0, ..., d_n).
+        :return: bool tensor of the same shape.
+        """
+        if not ignore_diagonal:
+            pool = [F.max_pool1d, F.max_pool2d, F.max_pool3d][self.n_dims - 1]
+            pooled = pool(mask[:, None].to(torch.float32), kernel_size=3, stride=1, padding=1)
+            return pooled[:, 0] > 0
+
+        adjacent = torch.zeros_like(mask)
+        for axis in range(1, self.n_dims + 1):
+            size = mask.shape[axis]
+            adjacent.narrow(axis, 1, size - 1).logical_or_(mask.narrow(axis, 0, size - 1))
+            adjacent.narrow(axis, 0, size - 1).logical_or_(mask.narrow(axis, 1, size - 1))
+        return adjacent
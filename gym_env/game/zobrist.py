@@ -0,0 +1,58 @@
+"""Zobrist hashing of Expando game states.
+
+Every feature of a state, i.e. a piece code at a cell, a player's cursor at a position or a player's scalars, has a
+pseudo random 64 bit key. The hash of a state is the xor of the keys of its features, so it can be updated
+incrementally whenever a single feature changes. Keys are derived from the feature's components with splitmix64
+instead of being stored in tables, so hashing works for boards of any size without allocating memory.
+"""
+from functools import lru_cache
+
+_MASK = (1 << 64) - 1
+
+# feature domains, so that keys of different kinds of features do not collide
+BOARD = 1
+CURSOR = 2
+SCALARS = 3
+
+
+def splitmix64(x):
+    """Scramble a 64 bit integer, see http://xorshift.di.unimi.it/splitmix64.c
+
+    :param x: non-negative integer.
+    :return: integer in [0, 2 ** 64).
+    """
+    x = (x + 0x9E3779B97F4A7C15) & _MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+@lru_cache(maxsize=1 << 16)
+def zobrist_key(*components):
+    """Get the key of a feature.
+
+    :param components: integers identifying the feature, starting with its domain, e.g. (BOARD, code, x, y).
+    :return: integer in [0, 2 ** 64).
+    """
+    key = 0
+    for c in components:
+        key = splitmix64(key ^ (int(c) & _MASK))
+    return key
+
+
+def cell_key(position, code):
+    """Key of a piece code at a cell. Empty cells do not contribute to the hash.
+    """
+    return zobrist_key(BOARD, code, *position)
+
+
+def cursor_key(player_id, position):
+    """Key of a player's cursor position.
+    """
+    return zobrist_key(CURSOR, player_id, *position)
+
+
+def scalars_key(player_id, population, room):
+    """Key of a player's population and room, which may be floats.
+    """
+    return zobrist_key(SCALARS, player_id, hash(population), hash(room))
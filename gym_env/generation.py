@@ -0,0 +1,127 @@
+"""Deterministic generation of Expando episodes in a process pool, e.g. for evaluations or datasets.
+
+Each episode is played with its own random streams, derived from one root seed and the episode's index with
+`numpy.random.SeedSequence`, like `SeedSequence(seed).spawn(n_episodes)[index]`. The streams neither depend on the
+process that plays the episode nor on the episodes it played before, so the generated episodes are bit-identical for any
+number of processes.
+
+Example:
+    from functools import partial
+    from gym_env.policies import GreedyFarmPolicy
+
+    if __name__ == '__main__':
+        episodes = generate_episodes({'grid_size': (12, 16)}, [partial(GreedyFarmPolicy, (12, 16))] * 2,
+                                     n_episodes=1000, seed=0, n_processes=8)
+"""
+from collections import namedtuple
+from multiprocessing import get_context
+
+import numpy as np
+
+from gym_env.env import Expando
+
+Episode = namedtuple('Episode', ['codes', 'cursors', 'scalars', 'actions', 'rewards', 'stats'])
+Episode.__doc__ = """An episode generated by `generate_episodes()`, with one row per turn, holding the state before the
+players acted. The arrays use the layout of `ExpandoRecorder`, but hold every player's actions and rewards.
+
+    codes: (n_turns, d_0, ..., d_n) categorical codes of the board, see `Board.codes`.
+    cursors: (n_turns, n_players, n_dims) cursor positions.
+    scalars: (n_turns, n_players, 2) room and population of each player.
+    actions: (n_turns, n_players) or (n_turns, n_players, 2) actions of each player.
+    rewards: (n_turns, n_players) rewards of each player.
+    stats: list of each player's episode statistics, see `ExpandoGame.get_episode_stats()`.
+"""
+
+# state of the current worker process, see `_init_worker()`
+_worker = None
+
+
+def generate_episodes(env_kwargs, policy_factories, n_episodes, seed=None, n_processes=1, deterministic=False,
+                      chunksize=1):
+    """Play episodes with one policy per player and collect them.
+
+    :param env_kwargs: keyword arguments of the Expando environment, without `policies_other`. Sparse boards are not
+    supported.
+    :param policy_factories: list of picklable callables, one per player, that take a seed as keyword argument and
+    return a policy with a stable baselines like `predict(obs, deterministic)` method, e.g.
+    `functools.partial(GreedyFarmPolicy, (12, 16))`. They are called at the start of every episode, with a seed from
+    the episode's stream.
+    :param n_episodes: number of episodes to generate.
+    :param seed: root seed of all episodes. Drawn from the OS if None.
+    :param n_processes: number of worker processes, 1 plays all episodes in the calling process.
+    :param deterministic: passed to the policies' `predict()`.
+    :param chunksize: number of episodes sent to a worker at once.
+    :return: list of Episodes, in the order of their indices.
+    """
+    assert env_kwargs.get('policies_other') is None, 'all players are controlled by `policy_factories`.'
+    assert not env_kwargs.get('sparse_board', False), 'sparse boards are not supported.'
+    entropy = np.random.SeedSequence(seed).entropy
+    args = (env_kwargs, policy_factories, entropy, deterministic)
+
+    if n_processes == 1:
+        _init_worker(*args)
+        try:
+            return [_play_episode(index) for index in range(n_episodes)]
+        finally:
+            _close_worker()
+
+    # spawned workers don't inherit any random state of the calling process
+    with get_context('spawn').Pool(n_processes, initializer=_init_worker, initargs=args) as pool:
+        return pool.map(_play_episode, range(n_episodes), chunksize=chunksize)
+
+
+def episode_seed_sequence(entropy, index):
+    """Get the seed sequence of an episode.
+
+    :param entropy: entropy of the root seed sequence.
+    :param index: index of the episode.
+    :return: a SeedSequence, equal to `SeedSequence(entropy).spawn(index + 1)[index]`.
+    """
+    return np.random.SeedSequence(entropy, spawn_key=(index,))
+
+
+def _init_worker(env_kwargs, policy_factories, entropy, deterministic):
+    """Create the environment that a worker process reuses for all its episodes.
+    """
+    global _worker
+    env = Expando(**env_kwargs)
+    assert len(policy_factories) == env.n_players, 'please provide a policy factory for each player.'
+    _worker = (env, policy_factories, entropy, deterministic)
+
+
+def _close_worker():
+    global _worker
+    _worker[0].close()
+    _worker = None
+
+
+def _play_episode(index):
+    """Play the episode with the given index in the worker's environment.
+    """
+    env, policy_factories, entropy, deterministic = _worker
+    game = env.game
+    # one seed for the environment and one per policy
+    seeds = [int(s) for s in episode_seed_sequence(entropy, index).generate_state(1 + env.n_players)]
+    policies = [factory(seed=s) for factory, s in zip(policy_factories, seeds[1:])]
+    env.seed(seeds[0])
+    observations = env.reset_all()
+
+    codes, cursors, scalars, actions, rewards = [], [], [], [], []
+    while True:
+        codes.append(game.board.codes.copy())
+        cursors.append([player.cursor.copy() for player in game.players])
+        scalars.append([(player.room, player.population) for player in game.players])
+        turn_actions = np.stack([np.asarray(policy.predict(obs[None], deterministic=deterministic)[0][0])
+                                 for obs, policy in zip(observations, policies)])
+        observations, turn_rewards, dones, info = env.step_all(turn_actions)
+        actions.append(turn_actions)
+        rewards.append(turn_rewards)
+        if dones[0]:
+            break
+
+    return Episode(np.stack(codes),
+                   np.array(cursors, dtype=np.int64),
+                   np.array(scalars, dtype=np.float64),
+                   np.stack(actions),
+                   np.stack(rewards),
+                   info['episode_stats'])
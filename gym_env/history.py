@@ -0,0 +1,94 @@
+import numpy as np
+
+from gym_env.game.encoding import codes_to_one_hot
+
+
+class BoardHistory:
+    """Ring buffer of the board codes of the last k steps.
+
+    The buffer is preallocated and every frame is written twice, at position i and i + k, so the last k frames are
+    always available in order as a contiguous view, without copying any frame that has already been stored. The one-hot
+    encodings of the frames are kept in ring buffers of the same layout, one per observing player, so that each frame
+    is only encoded once per player instead of once per observation.
+    """
+
+    def __init__(self, length, grid_size, dtype):
+        """
+
+        :param length: number of frames to keep.
+        :param grid_size: dimensions of the board.
+        :param dtype: dtype of the board codes.
+        """
+        self.length = length
+        self._buffer = None
+        self._frames = None
+        self._next = 0
+        # number of the frame stored in each slot, and the encodings and encoded frame numbers per player
+        self._stamps = np.zeros(length, dtype=np.int64)
+        self._n_frames = 0
+        self._encoded = {}
+        self.resize(grid_size, dtype)
+
+    def resize(self, grid_size, dtype):
+        """Change the dimensions of the stored boards. The buffer is only reallocated if it is too small or of another
+        dtype. The history has to be reset afterwards.
+
+        :param grid_size: dimensions of the board.
+        :param dtype: dtype of the board codes.
+        """
+        size = 2 * self.length * int(np.prod(grid_size))
+        if self._buffer is None or len(self._buffer) < size or self._buffer.dtype != dtype:
+            self._buffer = np.zeros(size, dtype=dtype)
+        self._frames = self._buffer[:size].reshape((2 * self.length,) + tuple(grid_size))
+        self._encoded = {}
+
+    def reset(self, codes):
+        """Fill the history with a single board, e.g. the initial board of an episode.
+
+        :param codes: board codes.
+        """
+        self._frames[:] = codes
+        self._next = 0
+        self._n_frames += 1
+        self._stamps[:] = self._n_frames
+
+    def push(self, codes):
+        """Add a board as the most recent frame, dropping the oldest one.
+
+        :param codes: board codes.
+        """
+        self._frames[self._next] = codes
+        self._frames[self._next + self.length] = codes
+        self._n_frames += 1
+        self._stamps[self._next] = self._n_frames
+        self._next = (self._next + 1) % self.length
+
+    @property
+    def frames(self):
+        """The stored frames, oldest first. Note that this is a view, which changes with the next `push()`.
+
+        :return: numpy array of shape (length, d_0, ..., d_n)
+        """
+        return self._frames[self._next:self._next + self.length]
+
+    def encoded_frames(self, player_id, permutation, one_hot_dim, dtype):
+        """The one-hot encodings of the stored frames from a player's perspective, oldest first. Only the frames that
+        were pushed since the player's last call are encoded. Note that this is a view, which changes with the next
+        call.
+
+        :param player_id: id of the observing player.
+        :param permutation: perspective lookup table of the player, see `perspective_permutation()`.
+        :param one_hot_dim: size of the one-hot encodings.
+        :param dtype: dtype of the encodings.
+        :return: numpy array of shape (length, d_0, ..., d_n, one_hot_dim)
+        """
+        cache = self._encoded.get(player_id)
+        if cache is None or cache[0].dtype != dtype or cache[0].shape[-1] != one_hot_dim:
+            cache = self._encoded[player_id] = (np.empty(self._frames.shape + (one_hot_dim,), dtype=dtype),
+                                                np.zeros(self.length, dtype=np.int64))
+        planes, stamps = cache
+        for slot in np.flatnonzero(stamps != self._stamps):
+            planes[slot] = codes_to_one_hot(self._frames[slot], one_hot_dim, permutation, dtype)
+            planes[slot + self.length] = planes[slot]
+            stamps[slot] = self._stamps[slot]
+        return planes[self._next:self._next + self.length]
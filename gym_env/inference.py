@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+import traceback
+from multiprocessing import Pipe, get_context
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+
+class InferenceServer:
+    """Runs opponent policies in a separate process and answers prediction requests from many env workers in batches.
+
+    The server owns the only copy of each policy. Env workers get lightweight `RemotePolicy` handles that can be passed
+    as `policies_other` to Expando and send their observations over a local socket. Requests are collected until either
+    `max_batch_size` observations are pending or the oldest request has waited for `max_latency` seconds, then each
+    policy predicts all of its pending observations at once.
+
+    Example:
+        server = InferenceServer([partial(DQN.load, path)]).start()
+        env = make_vec_env(Expando, n_envs=64, vec_env_cls=SubprocVecEnv,
+                           env_kwargs=dict(grid_size=(12, 16), policies_other=[server.policy(0)]))
+    """
+
+    def __init__(self, policy_loaders, max_batch_size=256, max_latency=0.002):
+        """
+
+        :param policy_loaders: list of picklable callables without arguments, each returning a policy with a stable
+        baselines like `predict(obs, deterministic)` method, e.g. `functools.partial(DQN.load, path)`. They are called
+        in the server process.
+        :param max_batch_size: number of pending observations that triggers a prediction.
+        :param max_latency: maximum time in seconds that a request waits for other requests to be batched with.
+        """
+        self.policy_loaders = policy_loaders
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.authkey = os.urandom(16)
+        self.address = None
+        self._process = None
+
+    def start(self):
+        """Start the server process and wait until all policies are loaded.
+
+        :return: self
+        """
+        receiver, sender = Pipe(duplex=False)
+        self._process = get_context('spawn').Process(target=_serve,
+                                                     args=(self.policy_loaders, self.authkey, self.max_batch_size,
+                                                           self.max_latency, sender),
+                                                     daemon=True)
+        self._process.start()
+        self.address = receiver.recv()
+        return self
+
+    def policy(self, policy_id, timeout=60.0):
+        """Get a handle for one of the served policies.
+
+        :param policy_id: index of the policy in `policy_loaders`.
+        :param timeout: maximum time in seconds that the handle waits for the actions of a request.
+        :return: a RemotePolicy
+        """
+        assert self.address is not None, 'the server needs to be started first.'
+        return RemotePolicy(self.address, self.authkey, policy_id, timeout)
+
+    def close(self):
+        """Stop the server process.
+        """
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RemotePolicy:
+    """Handle for a policy served by an InferenceServer. Can be pickled and connects lazily, so it can be passed to
+    subprocess env workers.
+    """
+
+    def __init__(self, address, authkey, policy_id, timeout=60.0):
+        """
+
+        :param address: address of the server.
+        :param authkey: authentication key of the server.
+        :param policy_id: index of the policy in the server's `policy_loaders`.
+        :param timeout: maximum time in seconds to wait for the actions of a request, None to wait indefinitely.
+        """
+        self.address = address
+        self.authkey = authkey
+        self.policy_id = policy_id
+        self.timeout = timeout
+        self._connection = None
+
+    def predict(self, observation, state=None, mask=None, deterministic=False):
+        """Request actions for an observation or a batch of observations.
+
+        :return: actions and None as state, like stable baselines policies.
+        :raises RuntimeError: if the server failed to predict the actions, closed the connection or didn't answer in
+        time.
+        """
+        if self._connection is None:
+            self._connection = Client(self.address, authkey=self.authkey)
+        try:
+            self._connection.send((self.policy_id, np.asarray(observation), deterministic))
+            if not self._connection.poll(self.timeout):
+                # a late answer must not be taken for the answer of the next request, so reconnect next time
+                self._connection.close()
+                self._connection = None
+                raise RuntimeError(f'the inference server did not answer within {self.timeout} seconds.')
+            answer = self._connection.recv()
+        except (BrokenPipeError, ConnectionResetError, EOFError) as e:
+            raise RuntimeError('the inference server closed the connection.') from e
+        if isinstance(answer, _ServerError):
+            raise RuntimeError(f'the inference server failed to predict actions:\n{answer.message}')
+        return answer, None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+
+class _ServerError:
+    """Sent instead of actions if a request failed, so that the client raises the error instead of waiting.
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _send(connection, answer):
+    # a client that died is dropped by the serve loop when its connection is read the next time
+    try:
+        connection.send(answer)
+    except (EOFError, OSError):
+        pass
+
+
+def _serve(policy_loaders, authkey, max_batch_size, max_latency, address_sender):
+    """Main loop of the server process.
+    """
+    policies = [load() for load in policy_loaders]
+    obs_shapes = [policy.observation_space.shape for policy in policies]
+
+    listener = Listener(authkey=authkey)
+    connections = []
+    lock = threading.Lock()
+
+    def accept():
+        while True:
+            connection = listener.accept()
+            with lock:
+                connections.append(connection)
+
+    threading.Thread(target=accept, daemon=True).start()
+    address_sender.send(listener.address)
+
+    pending = []
+    n_pending = 0
+    deadline = None
+    while True:
+        with lock:
+            waiting = list(connections)
+        # without pending requests, wake up regularly to pick up new connections
+        timeout = 0.05 if deadline is None else max(0.0, deadline - time.perf_counter())
+        if waiting:
+            ready = wait(waiting, timeout)
+        else:
+            time.sleep(timeout)
+            ready = []
+
+        for connection in ready:
+            try:
+                policy_id, obs, deterministic = connection.recv()
+            except (EOFError, OSError):
+                # the client closed the connection or died, e.g. with a reset
+                connection.close()
+                with lock:
+                    connections.remove(connection)
+                continue
+            try:
+                assert 0 <= policy_id < len(policies), f'unknown policy {policy_id}.'
+                # observations without batch dimension are treated as batch of size 1
+                obs = obs.reshape((-1,) + obs_shapes[policy_id])
+            except Exception:
+                _send(connection, _ServerError(traceback.format_exc()))
+                continue
+            pending.append((connection, policy_id, deterministic, obs))
+            n_pending += len(obs)
+            if deadline is None:
+                deadline = time.perf_counter() + max_latency
+
+        if pending and (n_pending >= max_batch_size or time.perf_counter() >= deadline):
+            _predict_batches(policies, pending)
+            pending = []
+            n_pending = 0
+            deadline = None
+
+
+def _predict_batches(policies, requests):
+    """Predict the actions of all requests, batched per policy, and send them back.
+
+    :param policies: list of policies.
+    :param requests: list of (connection, policy_id, deterministic, obs) tuples.
+    """
+    groups = {}
+    for request in requests:
+        groups.setdefault(request[1:3], []).append(request)
+
+    for (policy_id, deterministic), group in groups.items():
+        batch = np.concatenate([obs for _, _, _, obs in group])
+        try:
+            actions, _ = policies[policy_id].predict(batch, deterministic=deterministic)
+        except Exception:
+            # the server keeps running, the clients of the group raise the error
+            error = _ServerError(traceback.format_exc())
+            for connection, _, _, _ in group:
+                _send(connection, error)
+            continue
+        split_at = np.cumsum([len(obs) for _, _, _, obs in group])[:-1]
+        for (connection, _, _, _), group_actions in zip(group, np.split(actions, split_at)):
+            _send(connection, group_actions)
@@ -0,0 +1,54 @@
+class LazyObservation:
+    """An observation that is only encoded when it is read. It holds a snapshot of the state that the observation is
+    built from, e.g. copies of the board codes, the cursor and the scalars, together with the function encoding them.
+    The encoding runs on the first conversion to a numpy array, e.g. by `np.asarray()`, and is cached, so that further
+    reads are free and consumers that never read the observation never pay for it.
+    """
+
+    def __init__(self, encode, *state):
+        """
+
+        :param encode: function that builds the observation from the snapshot.
+        :param state: snapshot of the state, passed to `encode`. It must not change after the observation is created.
+        """
+        self._encode = encode
+        self._state = state
+        self._value = None
+
+    @property
+    def value(self):
+        """The encoded observation.
+        """
+        if self._value is None:
+            self._value = self._encode(*self._state)
+            # the snapshot isn't needed anymore
+            self._encode, self._state = None, None
+        return self._value
+
+    @property
+    def is_materialized(self):
+        return self._value is not None
+
+    @property
+    def shape(self):
+        return self.value.shape
+
+    @property
+    def dtype(self):
+        return self.value.dtype
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.value
+        return self.value.astype(dtype, copy=False)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, item):
+        return self.value[item]
+
+    def __repr__(self):
+        if self.is_materialized:
+            return f'LazyObservation({self.value!r})'
+        return 'LazyObservation(<not encoded>)'
@@ -0,0 +1,116 @@
+"""Torch-free inference for trained DQN policies.
+
+A trained stable baselines `DQN` with an `MlpPolicy` is exported once into a compressed .npz file holding the weights
+of its Q-network. `NumpyMlpPolicy` loads such a file and computes the forward pass with numpy only, so env workers and
+opponents don't need to import torch or hold a full model.
+
+Example:
+    export_dqn(DQN.load('ckpts/rl_model_5000000_steps.zip'), 'ckpts/policy.npz')
+    env = Expando(grid_size=(12, 16), flat_observations=True, policies_other=[NumpyMlpPolicy.load('ckpts/policy.npz')])
+"""
+import numpy as np
+from gym.spaces import Box
+
+_ACTIVATIONS = {'ReLU': lambda x: np.maximum(x, 0, out=x),
+                'Tanh': lambda x: np.tanh(x, out=x)}
+
+
+def export_dqn(model, path):
+    """Export the Q-network of a DQN model with an MlpPolicy into a weights file for `NumpyMlpPolicy`.
+
+    :param model: a stable baselines DQN model.
+    :param path: file to write the weights to, e.g. 'policy.npz'.
+    """
+    layers = {}
+    activation = None
+    n_layers = 0
+    for module in model.q_net.q_net:
+        name = module.__class__.__name__
+        if name == 'Linear':
+            layers[f'weight_{n_layers}'] = module.weight.detach().cpu().numpy().T
+            layers[f'bias_{n_layers}'] = module.bias.detach().cpu().numpy()
+            n_layers += 1
+        else:
+            assert name in _ACTIVATIONS, f'activation {name} is not supported.'
+            assert activation in (None, name), 'all hidden layers need to use the same activation.'
+            activation = name
+
+    np.savez_compressed(path,
+                        n_layers=n_layers,
+                        activation=activation or 'ReLU',
+                        observation_shape=np.array(model.observation_space.shape),
+                        exploration_rate=model.exploration_rate,
+                        **layers)
+
+
+class NumpyMlpPolicy:
+    """Numpy implementation of the forward pass of an exported DQN Q-network, see `export_dqn()`. Implements stable
+    baselines' `predict()` interface.
+    """
+
+    def __init__(self, weights, biases, activation='ReLU', observation_shape=None, exploration_rate=0.0, seed=None):
+        """
+
+        :param weights: list of weight matrices of shape (n_in, n_out), one per linear layer.
+        :param biases: list of bias vectors, one per linear layer.
+        :param activation: name of the activation applied after each hidden layer, 'ReLU' or 'Tanh'.
+        :param observation_shape: shape of a single observation. Defaults to a flat vector.
+        :param exploration_rate: probability of taking a random action when predicting non-deterministically.
+        :param seed: seed for exploration.
+        """
+        self.weights = [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activation = _ACTIVATIONS[activation]
+        if observation_shape is None:
+            observation_shape = (self.weights[0].shape[0],)
+        self.observation_space = Box(0.0, 1.0, shape=tuple(int(d) for d in observation_shape))
+        self.n_actions = self.weights[-1].shape[1]
+        self.exploration_rate = exploration_rate
+        self.np_random = np.random.default_rng(seed)
+
+    @classmethod
+    def load(cls, path, seed=None):
+        """Load a policy from a file written by `export_dqn()`.
+
+        :param path: path to the .npz file.
+        :param seed: seed for exploration.
+        :return: a NumpyMlpPolicy
+        """
+        with np.load(path) as data:
+            n_layers = int(data['n_layers'])
+            return cls([data[f'weight_{i}'] for i in range(n_layers)],
+                       [data[f'bias_{i}'] for i in range(n_layers)],
+                       activation=str(data['activation']),
+                       observation_shape=data['observation_shape'],
+                       exploration_rate=float(data['exploration_rate']),
+                       seed=seed)
+
+    def q_values(self, observation):
+        """Compute the Q-values of a batch of observations.
+
+        :param observation: array of shape (batch, *observation_shape).
+        :return: array of shape (batch, n_actions).
+        """
+        x = np.asarray(observation, dtype=np.float32).reshape(len(observation), -1)
+        for i, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            x = x @ weight
+            x += bias
+            if i < len(self.weights) - 1:
+                x = self.activation(x)
+        return x
+
+    def predict(self, observation, state=None, mask=None, deterministic=False):
+        """Get the greedy actions for an observation or a batch of observations. Like stable baselines' DQN, a random
+        action is taken with probability `exploration_rate` if `deterministic` is False.
+
+        :param observation: observation or batch of observations.
+        :return: actions and None as state, like stable baselines policies.
+        """
+        observation = np.asarray(observation)
+        is_batch = observation.shape != self.observation_space.shape
+        observation = observation.reshape((-1,) + self.observation_space.shape)
+
+        actions = self.q_values(observation).argmax(axis=-1)
+        if not deterministic and self.np_random.random() < self.exploration_rate:
+            actions = self.np_random.integers(self.n_actions, size=len(actions))
+        return (actions if is_batch else actions[0]), None
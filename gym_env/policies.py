@@ -0,0 +1,188 @@
+"""Scripted opponents for the Expando environment.
+
+The policies work on batches of observations in the 'grid' or 'flat' format, as seen by the acting player, and compute
+their actions with array operations over the whole board. They implement stable baselines' `predict()` interface, so
+they can be used as `policies_other` or be evaluated on the observations of vectorized environments directly.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from gym_env.game.actions import get_action_table
+
+
+class HeuristicPolicy(ABC):
+    """Base-class for scripted policies. Each turn a policy chooses a set of target cells and a piece type per
+    observation. The cursor is moved towards the nearest target cell and the piece is placed once it reaches the target.
+    """
+
+    def __init__(self, grid_size, n_players=2, piece_types=('empty', 'farm', 'city'), flat_observations=False,
+                 multi_discrete_actions=False, seed=None):
+        """
+
+        :param grid_size: dimensions of the board.
+        :param n_players: number of players in the game.
+        :param piece_types: names of the piece types in the order of the game's configuration, or the piece type config.
+        :param flat_observations: whether the policy receives flat observations or grid observations.
+        :param multi_discrete_actions: whether to return multi-discrete or discrete actions.
+        :param seed: seed for breaking ties between equally distant target cells.
+        """
+        self.grid_size = tuple(grid_size)
+        self.n_dims = len(self.grid_size)
+        self.name_to_id = {name: i for i, name in enumerate(piece_types)}
+        self.n_piece_types = len(self.name_to_id)
+        self.one_hot_dim = 1 + n_players * (self.n_piece_types - 1)
+        self.flat_observations = flat_observations
+        self.multi_discrete_actions = multi_discrete_actions
+        self.np_random = np.random.default_rng(seed)
+
+        self._n_cells = int(np.prod(self.grid_size))
+        self._positions = np.stack(np.unravel_index(np.arange(self._n_cells), self.grid_size), axis=-1)
+        self._actions = get_action_table(self.n_dims, self.n_piece_types)
+
+    def predict(self, observation, state=None, mask=None, deterministic=False):
+        """Get the actions for an observation or a batch of observations.
+
+        :param observation: observation or batch of observations of the acting player.
+        :param deterministic: if False, ties between equally distant targets are broken randomly.
+        :return: array of actions and None as state, like stable baselines policies.
+        """
+        codes, cursors, populations, rooms = self._decode(np.asarray(observation))
+        targets, piece_ids = self.choose_targets(codes, populations, rooms)
+        return self._to_actions(targets.reshape(len(codes), -1), piece_ids, cursors, deterministic), None
+
+    @abstractmethod
+    def choose_targets(self, codes, populations, rooms):
+        """Choose the cells to move to and the type of piece to place there.
+
+        :param codes: board codes as seen by the acting player, i.e. its own pieces have codes 1 to n_piece_types - 1.
+        :param populations: populations of the acting player.
+        :param rooms: rooms of the acting player.
+        :return: boolean array of target cells with the same shape as `codes`, integer array of piece ids per batch
+        entry.
+        """
+
+    def own(self, codes, piece_name):
+        """Mask of the acting player's pieces of a type.
+        """
+        return codes == self.name_to_id[piece_name]
+
+    def free_adjacent(self, codes, mask):
+        """Mask of the free cells that are adjacent to a cell in `mask`, ignoring diagonals.
+
+        :param codes: batch of board codes.
+        :param mask: boolean array with the same shape as `codes`.
+        :return: boolean array
+        """
+        adjacent = np.zeros_like(mask)
+        for axis in range(1, mask.ndim):
+            lower = [slice(None)] * mask.ndim
+            upper = [slice(None)] * mask.ndim
+            lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+            adjacent[tuple(upper)] |= mask[tuple(lower)]
+            adjacent[tuple(lower)] |= mask[tuple(upper)]
+        return adjacent & (codes == 0)
+
+    def _decode(self, obs):
+        """Extract the board codes, cursors, populations and rooms from a batch of observations.
+        """
+        d = self.one_hot_dim
+        if self.flat_observations:
+            obs = obs.reshape(-1, obs.shape[-1])
+            n_one_hot = self._n_cells * d
+            one_hots = obs[:, :n_one_hot].reshape((-1,) + self.grid_size + (d,))
+            cursors = np.rint(obs[:, n_one_hot:n_one_hot + self.n_dims] * self.grid_size).astype(np.int64)
+            populations, rooms = obs[:, -2] * self._n_cells, obs[:, -1] * self._n_cells
+        else:
+            obs = obs.reshape((-1,) + self.grid_size + (d + 3,))
+            one_hots = obs[..., :d]
+            cursor_cells = obs[..., d].reshape(len(obs), -1).argmax(axis=-1)
+            cursors = self._positions[cursor_cells]
+            first_cell = (slice(None),) + (0,) * self.n_dims
+            populations, rooms = obs[first_cell + (d + 1,)] * self._n_cells, obs[first_cell + (d + 2,)] * self._n_cells
+        return one_hots.argmax(axis=-1), cursors, populations, rooms
+
+    def _to_actions(self, targets, piece_ids, cursors, deterministic):
+        """Move each cursor one step towards its nearest target and place the piece if the target is reached.
+
+        :param targets: boolean array of shape (batch, n_cells).
+        :param piece_ids: integer array of shape (batch,).
+        :param cursors: integer array of shape (batch, n_dims).
+        :return: actions, either of shape (batch,) or (batch, 2) for multi-discrete actions.
+        """
+        deltas = self._positions[None] - cursors[:, None]
+        distances = np.abs(deltas).sum(axis=-1).astype(np.float64)
+        if not deterministic:
+            distances += self.np_random.uniform(0, 0.5, size=distances.shape)
+        distances[~targets] = np.inf
+        nearest = distances.argmin(axis=-1)
+        has_target = targets.any(axis=-1)
+
+        batch_idx = np.arange(len(targets))
+        delta = deltas[batch_idx, nearest]
+        axis = np.abs(delta).argmax(axis=-1)
+        step = delta[batch_idx, axis]
+        moves = np.where(step == 0, 0, self._actions.axis_moves[(step > 0).astype(np.int64), axis])
+        # the piece is placed after moving, so it can be placed one step ahead of the target
+        place = has_target & (np.abs(delta).sum(axis=-1) <= 1)
+
+        moves = np.where(has_target, moves, 0)
+        piece_ids = np.where(place, piece_ids, 0)
+        return self._actions.encode(moves, piece_ids, self.multi_discrete_actions)
+
+
+class NearestFreeCellPolicy(HeuristicPolicy):
+    """Moves to the nearest free cell and places a fixed type of piece there.
+    """
+
+    def __init__(self, grid_size, piece='farm', **kwargs):
+        """
+
+        :param piece: name of the piece type to place.
+        """
+        super().__init__(grid_size, **kwargs)
+        self.piece_id = self.name_to_id[piece]
+
+    def choose_targets(self, codes, populations, rooms):
+        return codes == 0, np.full(len(codes), self.piece_id)
+
+
+class GreedyFarmPolicy(HeuristicPolicy):
+    """Places farms next to its own cities, where they generate reward. Places a city at the nearest free cell if it
+    doesn't own any city with a free adjacent cell yet.
+    """
+
+    def choose_targets(self, codes, populations, rooms):
+        farm_targets = self.free_adjacent(codes, self.own(codes, 'city'))
+        has_farm_target = farm_targets.reshape(len(codes), -1).any(axis=-1)
+
+        targets = np.where(_expand(has_farm_target, codes.ndim), farm_targets, codes == 0)
+        piece_ids = np.where(has_farm_target, self.name_to_id['farm'], self.name_to_id['city'])
+        return targets, piece_ids
+
+
+class CityFirstPolicy(HeuristicPolicy):
+    """Manages room first: places a city next to its own farms whenever the population exceeds the available room, so
+    that no happiness penalty applies. Otherwise places farms next to its own cities.
+    """
+
+    def choose_targets(self, codes, populations, rooms):
+        batch_size = len(codes)
+        free = codes == 0
+        city_targets = self.free_adjacent(codes, self.own(codes, 'farm'))
+        has_city_target = city_targets.reshape(batch_size, -1).any(axis=-1)
+        city_targets = np.where(_expand(has_city_target, codes.ndim), city_targets, free)
+
+        farm_targets = self.free_adjacent(codes, self.own(codes, 'city'))
+        has_farm_target = farm_targets.reshape(batch_size, -1).any(axis=-1)
+
+        needs_room = (populations >= rooms) | ~has_farm_target
+        targets = np.where(_expand(needs_room, codes.ndim), city_targets, farm_targets)
+        piece_ids = np.where(needs_room, self.name_to_id['city'], self.name_to_id['farm'])
+        return targets, piece_ids
+
+
+def _expand(x, ndim):
+    """Append axes to a batch of scalars, so that it broadcasts against arrays with `ndim` dimensions.
+    """
+    return x.reshape((-1,) + (1,) * (ndim - 1))
@@ -0,0 +1,166 @@
+import json
+import os
+
+import numpy as np
+from gym import Wrapper
+from numpy.lib.format import open_memmap
+
+
+class ExpandoRecorder(Wrapper):
+    """Wraps an Expando environment and streams the transitions of player 0 to disk.
+
+    Instead of pickling observations, each transition is stored compactly as the categorical codes of the board (see
+    `Board.codes`), all players' cursors and scalars (room, population), the action taken, the reward received,
+    whether the episode ended and the zobrist hash of the state (see `ExpandoGame.state_hash`), which allows to find
+    identical states without decoding them. Rows are written into preallocated memory-mapped .npy arrays, which are
+    grouped into chunks of `chunk_size` rows. A row holds the state that player 0 observed before acting, so the next
+    state of a row is the following row of the same episode.
+
+    Directory layout:
+        meta.json: game configuration and number of recorded rows, needed for decoding observations.
+        episodes.npy: int64 array of shape (n_episodes, 2) holding (first row, number of transitions) per episode.
+        chunk_xxxxx/{codes, cursors, scalars, actions, rewards, dones, hashes}.npy: the transition rows of a chunk.
+
+    Chunks are allocated with `chunk_size` rows, only the first `meta['n_rows'] - chunk_id * chunk_size` rows of the
+    last chunk are valid.
+
+    A recording holds a single board layout. If the board is resized with `Expando.reconfigure()`, the recorded rows are
+    flushed and an error is raised at the next reset, so a new recorder has to be created for the new layout.
+    """
+
+    def __init__(self, env, directory, chunk_size=65536):
+        """
+
+        :param env: the Expando environment to record.
+        :param directory: directory to write the recorded episodes to. Is created if it does not exist.
+        :param chunk_size: number of rows preallocated per chunk file.
+        """
+        super().__init__(env)
+        game = self.env.unwrapped.game
+        assert not game.board.sparse, 'recording requires a dense board.'
+        assert not os.path.exists(os.path.join(directory, 'meta.json')), 'directory already contains a recording.'
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.meta = {**self._layout(game),
+                     'piece_types': list(game.name_to_id.keys()),
+                     'observation_format': self.env.unwrapped.observation_format,
+                     'action_shape': list(self.action_space.shape or ()),
+                     'chunk_size': chunk_size,
+                     'n_rows': 0}
+
+        self.episodes = []
+        self.n_rows = 0
+        self._episode_start = None
+        self._chunk = None
+        self._chunk_id = -1
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self._end_episode()
+        self._begin_episode()
+        return obs
+
+    def step(self, action, *args, **kwargs):
+        obs, reward, done, info = self.env.step(action, *args, **kwargs)
+        if self._episode_start is None:
+            raise RuntimeError('reset() needs to be called before recording steps.')
+
+        i = self.n_rows % self.chunk_size
+        self._chunk['actions'][i] = action
+        self._chunk['rewards'][i] = reward
+        self._chunk['dones'][i] = done
+        self.n_rows += 1
+
+        if done:
+            # Expando resets the game on done, so the next episode starts right away
+            self._end_episode()
+            self._begin_episode()
+        else:
+            self._write_state()
+        return obs, reward, done, info
+
+    def flush(self):
+        """Flush all recorded rows and write the episode index and meta data.
+        """
+        if self._chunk is not None:
+            for array in self._chunk.values():
+                array.flush()
+        self.meta['n_rows'] = self.n_rows
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as fp:
+            json.dump(self.meta, fp, indent=2)
+        np.save(os.path.join(self.directory, 'episodes.npy'), np.array(self.episodes, dtype=np.int64).reshape(-1, 2))
+
+    def close(self):
+        self._end_episode()
+        self.flush()
+        self._chunk = None
+        super().close()
+
+    def _begin_episode(self):
+        layout = self._layout(self.env.unwrapped.game)
+        if any(self.meta[key] != value for key, value in layout.items()):
+            # the rows recorded so far stay readable
+            self.flush()
+            raise RuntimeError(f'the board layout changed from {self.meta["grid_size"]} with {self.meta["n_players"]} '
+                               f'players to {layout["grid_size"]} with {layout["n_players"]} players, please record '
+                               f'it with a new recorder.')
+        self._episode_start = self.n_rows
+        self._write_state()
+
+    def _end_episode(self):
+        """Add the current episode to the index, unfinished episodes are kept with the transitions recorded so far.
+        """
+        if self._episode_start is not None and self.n_rows > self._episode_start:
+            self.episodes.append((self._episode_start, self.n_rows - self._episode_start))
+        self._episode_start = None
+
+    @staticmethod
+    def _layout(game):
+        """The meta data that determines the layout of the recorded rows.
+        """
+        return {'grid_size': list(game.grid_size),
+                'n_players': game.n_players,
+                'one_hot_dim': game.board.one_hot_dim,
+                'codes_dtype': np.dtype(game.board.codes_dtype).str}
+
+    def _write_state(self):
+        """Write the current game state into the next row, allocating a new chunk if the current one is full.
+        """
+        chunk_id, i = divmod(self.n_rows, self.chunk_size)
+        if chunk_id != self._chunk_id:
+            self._new_chunk(chunk_id)
+
+        game = self.env.unwrapped.game
+        chunk = self._chunk
+        chunk['codes'][i] = game.board.codes
+        for p, player in enumerate(game.players):
+            chunk['cursors'][i, p] = player.cursor
+            chunk['scalars'][i, p] = player.room, player.population
+        chunk['hashes'][i] = game.state_hash
+
+    def _new_chunk(self, chunk_id):
+        """Preallocate the memory-mapped arrays of a new chunk.
+
+        :param chunk_id: index of the chunk.
+        """
+        if self._chunk is not None:
+            self.flush()
+
+        chunk_dir = os.path.join(self.directory, f'chunk_{chunk_id:05d}')
+        os.makedirs(chunk_dir, exist_ok=True)
+        grid_size = tuple(self.meta['grid_size'])
+        n_players = self.meta['n_players']
+        n = self.chunk_size
+        specs = {'codes': (self.meta['codes_dtype'], (n,) + grid_size),
+                 'cursors': (np.int32, (n, n_players, len(grid_size))),
+                 'scalars': (np.float32, (n, n_players, 2)),
+                 'actions': (np.int32, (n,) + tuple(self.meta['action_shape'])),
+                 'rewards': (np.float32, (n,)),
+                 'dones': (np.bool_, (n,)),
+                 'hashes': (np.uint64, (n,))}
+
+        self._chunk = {name: open_memmap(os.path.join(chunk_dir, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+                       for name, (dtype, shape) in specs.items()}
+        self._chunk_id = chunk_id
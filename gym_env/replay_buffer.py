@@ -0,0 +1,140 @@
+from typing import Optional
+
+import numpy as np
+from stable_baselines3.common.buffers import BaseBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+from gym_env.spaces import OneHotBox
+
+
+class ExpandoReplayBuffer(BaseBuffer):
+    """Replay buffer for Expando observations that stores each state once, as categorical board codes, the cursor
+    position and the normalized scalars, instead of dense one-hot observations. The next observation of a transition is
+    the observation stored at the next index, like in stable baselines' `optimize_memory_usage` mode. Next observations
+    of transitions that end an episode are kept separately, so they are returned exactly as well. Each observation is
+    only encoded once, since the observation of a transition is the next observation of the previous one within an
+    episode.
+
+    Sampled batches are decoded into the flat or grid format of the observation space with array operations over the
+    whole batch. For the default 12 x 16 board, a transition takes ~220 bytes instead of ~7.7 kB.
+    """
+
+    def __init__(self, buffer_size, observation_space, action_space, device='cpu', n_envs=1,
+                 optimize_memory_usage=False):
+        """
+
+        :param buffer_size: max number of transitions in the buffer.
+        :param observation_space: a OneHotBox observation space of Expando, i.e. without window, history or delta
+        transport.
+        :param action_space: action space.
+        :param device: PyTorch device that sampled batches are moved to.
+        :param n_envs: number of parallel environments, only 1 is supported.
+        :param optimize_memory_usage: ignored, for compatibility with stable baselines' ReplayBuffer.
+        """
+        super().__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        assert n_envs == 1, 'replay buffer only supports a single environment'
+        assert isinstance(observation_space, OneHotBox), 'the observation space needs to be a OneHotBox.'
+
+        self.flatten = observation_space.flatten
+        self.grid_size = tuple(observation_space.one_hot.shape[:-1])
+        self.one_hot_dim = observation_space.one_hot.one_hot_dim
+        self.n_dims = len(self.grid_size)
+        self.n_cells = int(np.prod(self.grid_size))
+
+        self.codes = np.zeros((buffer_size,) + self.grid_size, dtype=np.min_scalar_type(self.one_hot_dim - 1))
+        self.cursors = np.zeros((buffer_size, self.n_dims), dtype=np.min_scalar_type(max(self.grid_size)))
+        self.scalars = np.zeros((buffer_size, 2), dtype=observation_space.dtype)
+        self.actions = np.zeros((buffer_size, self.action_dim), dtype=action_space.dtype)
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.dones = np.zeros(buffer_size, dtype=np.float32)
+        # compact next states of the transitions that ended an episode, by index
+        self.terminal_states = {}
+        # the next observation of the latest transition, which is already stored at index `pos`
+        self._last_next_obs = None
+
+    def add(self, obs, next_obs, action, reward, done):
+        next_pos = (self.pos + 1) % self.buffer_size
+        self.terminal_states.pop(self.pos, None)
+        # stable baselines passes the previous next observation again, except at the start of an episode
+        if obs is not self._last_next_obs:
+            self._store(self.pos, obs)
+        if done:
+            self.terminal_states[self.pos] = self._encode(np.asarray(next_obs))
+            self._last_next_obs = None
+        else:
+            self._store(next_pos, next_obs)
+            self._last_next_obs = next_obs
+
+        self.actions[self.pos] = np.asarray(action).reshape(self.action_dim)
+        self.rewards[self.pos] = np.asarray(reward).item()
+        self.dones[self.pos] = np.asarray(done).item()
+
+        self.pos = next_pos
+        if self.pos == 0:
+            self.full = True
+
+    def reset(self):
+        super().reset()
+        self._last_next_obs = None
+
+    def sample(self, batch_size, env: Optional[VecNormalize] = None):
+        # the index `pos` only holds the next state of the latest transition
+        if self.full:
+            batch_inds = (np.random.randint(1, self.buffer_size, size=batch_size) + self.pos) % self.buffer_size
+        else:
+            batch_inds = np.random.randint(0, self.pos, size=batch_size)
+        return self._get_samples(batch_inds, env=env)
+
+    def _get_samples(self, batch_inds, env: Optional[VecNormalize] = None):
+        next_inds = (batch_inds + 1) % self.buffer_size
+        next_codes, next_cursors, next_scalars = self.codes[next_inds], self.cursors[next_inds], self.scalars[next_inds]
+        for i, index in enumerate(batch_inds):
+            if index in self.terminal_states:
+                next_codes[i], next_cursors[i], next_scalars[i] = self.terminal_states[index]
+
+        data = (self._normalize_obs(self._decode(self.codes[batch_inds], self.cursors[batch_inds],
+                                                 self.scalars[batch_inds]), env),
+                self.actions[batch_inds],
+                self._normalize_obs(self._decode(next_codes, next_cursors, next_scalars), env),
+                self.dones[batch_inds, None],
+                self._normalize_reward(self.rewards[batch_inds, None], env))
+        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
+
+    def _store(self, index, obs):
+        self.codes[index], self.cursors[index], self.scalars[index] = self._encode(np.asarray(obs))
+
+    def _encode(self, obs):
+        """Extract the board codes, cursor and scalars from a single observation.
+        """
+        d = self.one_hot_dim
+        if self.flatten:
+            obs = obs.reshape(-1)
+            n_one_hot = self.n_cells * d
+            codes = obs[:n_one_hot].reshape(self.grid_size + (d,)).argmax(axis=-1)
+            cursor = np.rint(obs[n_one_hot:n_one_hot + self.n_dims] * self.grid_size)
+            return codes, cursor, obs[-2:]
+
+        obs = obs.reshape(self.grid_size + (d + 3,))
+        cursor = np.unravel_index(obs[..., d].argmax(), self.grid_size)
+        return obs[..., :d].argmax(axis=-1), cursor, obs[(0,) * self.n_dims + (slice(d + 1, d + 3),)]
+
+    def _decode(self, codes, cursors, scalars):
+        """Rebuild a batch of observations in the format of the observation space.
+        """
+        batch_size = len(codes)
+        d = self.one_hot_dim
+        if self.flatten:
+            obs = np.zeros((batch_size,) + self.observation_space.shape, dtype=self.observation_space.dtype)
+            n_one_hot = self.n_cells * d
+            planes = obs[:, :n_one_hot].reshape(batch_size, self.n_cells, d)
+            np.put_along_axis(planes, codes.reshape(batch_size, self.n_cells, 1).astype(np.intp), 1, axis=-1)
+            obs[:, n_one_hot:n_one_hot + self.n_dims] = cursors / np.array(self.grid_size)
+            obs[:, -2:] = scalars
+            return obs
+
+        obs = np.zeros(codes.shape + (d + 3,), dtype=self.observation_space.dtype)
+        np.put_along_axis(obs, codes[..., None].astype(np.intp), 1, axis=-1)
+        obs[(np.arange(batch_size),) + tuple(cursors.T.astype(np.intp)) + (d,)] = 1
+        obs[..., d + 1:] = scalars.reshape((batch_size,) + (1,) * self.n_dims + (2,))
+        return obs
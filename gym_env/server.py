@@ -0,0 +1,381 @@
+"""Asyncio match server hosting many concurrent Expando games in a single process.
+
+Agents and scripted bots connect over a local TCP socket and exchange JSON messages, one per line:
+
+    client -> server
+        {"type": "join"}                                      queue up for the next match.
+        {"type": "action", "action": 7, "turn": 12}           act in a turn, discrete or [move, piece].
+    server -> client
+        {"type": "start", "match_id", "player_id", "grid_size", "n_players", "one_hot_dim"}
+        {"type": "turn", "turn", "observation", "reward"}     it's the player's turn, reward since its last turn.
+        {"type": "end", "observation", "reward", "stats"}     the game is over, see `ExpandoGame.get_episode_stats()`.
+        {"type": "error", "message"}
+
+Observations are sparse, see `Player.get_sparse_observation()`, with numpy arrays converted to lists and the pieces in
+row-major order of their positions. Players act in the order of their ids. A player that does not act within
+`turn_timeout` seconds, or has disconnected, passes the turn with a no-op action. Actions that echo the number of a turn
+that has already passed are ignored. Instead of stepping each game as soon as an action arrives, the server advances all
+games that are ready once per tick, so that the game logic doesn't interleave with message handling. The turns are
+applied game by game, since the pieces' rules are python objects of each game, but the observations sent afterwards are
+built for all ready games at once, with array operations over their stacked boards. Clients that don't read their
+messages fast enough are disconnected once more than `max_write_buffer` bytes are waiting to be sent to them, so slow
+clients can't grow the server's memory without bound.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+
+import numpy as np
+
+from gym_env.game.encoding import build_observations
+from gym_env.game.game import ExpandoGame
+
+# no cursor movement and no piece placement
+NOOP_ACTION = 0
+
+
+class MatchServer:
+    """Matches connected clients into games and runs the games. See the module's docstring for the protocol.
+    """
+
+    def __init__(self, grid_size, n_players=2, max_turns=100, final_reward=100, piece_types=None, turn_timeout=1.0,
+                 tick=0.005, seed=None, max_write_buffer=2 ** 20):
+        """
+
+        :param grid_size: dimensions of the boards.
+        :param n_players: number of players per match.
+        :param max_turns: maximum number of turns per match.
+        :param final_reward: reward for the winner, see `ExpandoGame`.
+        :param piece_types: piece type configs, defaults to the default config of Expando.
+        :param turn_timeout: seconds that a player has to act before a no-op action is taken for it.
+        :param tick: seconds between two steps of all ready games.
+        :param seed: seed of the first match, the i-th match is seeded with seed + i.
+        :param max_write_buffer: number of bytes waiting to be sent to a client, above which the client is
+        disconnected.
+        """
+        if piece_types is None:
+            from gym_env.env import Expando
+            piece_types = Expando._get_default_piece_types()
+
+        self.game_kwargs = dict(grid_size=tuple(grid_size), n_players=n_players, max_turns=max_turns,
+                                final_reward=final_reward, piece_types=piece_types)
+        self.n_players = n_players
+        self.turn_timeout = turn_timeout
+        self.tick = tick
+        self.seed = seed
+        self.max_write_buffer = max_write_buffer
+        # the position of each cell as list, in row-major order, shared by the observations of all matches
+        self._cell_positions = [list(position) for position in np.ndindex(*grid_size)]
+
+        self.matches = {}
+        self._lobby = []
+        self._match_ids = itertools.count()
+        self._server = None
+        self._ticker = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start accepting connections and running games.
+
+        :param host: address to listen on.
+        :param port: port to listen on, 0 picks a free port.
+        :return: self
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._ticker = asyncio.ensure_future(self._run_ticks())
+        return self
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self._ticker
+
+    async def close(self):
+        """Stop the server and drop all running matches.
+        """
+        self._ticker.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+        for match in self.matches.values():
+            for connection in match.connections:
+                connection.close()
+        self.matches.clear()
+
+    async def _handle_connection(self, reader, writer):
+        """Read the messages of a client until it disconnects.
+        """
+        connection = _Connection(writer, self.max_write_buffer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    self._on_message(connection, message)
+                except (AssertionError, ValueError, KeyError, TypeError) as e:
+                    connection.send({'type': 'error', 'message': str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            connection.is_closed = True
+            if connection in self._lobby:
+                self._lobby.remove(connection)
+
+    def _on_message(self, connection, message):
+        if message['type'] == 'join':
+            assert connection.match is None, 'already playing a match.'
+            if connection not in self._lobby:
+                self._lobby.append(connection)
+            if len(self._lobby) >= self.n_players:
+                self._start_match(self._lobby[:self.n_players])
+                del self._lobby[:self.n_players]
+        elif message['type'] == 'action':
+            match = connection.match
+            assert match is not None, 'not playing a match.'
+            if message.get('turn', match.game.n_turns) != match.game.n_turns:
+                # the turn has timed out already
+                return
+            assert match.current_player == connection.player_id, 'not your turn.'
+            match.pending_action = _parse_action(message['action'], match.game)
+        else:
+            raise ValueError(f'unknown message type {message["type"]}.')
+
+    def _start_match(self, connections):
+        match_id = next(self._match_ids)
+        seed = None if self.seed is None else self.seed + match_id
+        match = _Match(match_id, ExpandoGame(**self.game_kwargs, seed=seed), connections)
+        self.matches[match_id] = match
+
+        board = match.game.board
+        for player_id, connection in enumerate(connections):
+            connection.match, connection.player_id = match, player_id
+            connection.send({'type': 'start', 'match_id': match_id, 'player_id': player_id,
+                             'grid_size': list(board.grid_size), 'n_players': self.n_players,
+                             'one_hot_dim': board.one_hot_dim})
+        self._begin_turn(match, _sparse_observations([match.game], [0], self._cell_positions)[0])
+
+    async def _run_ticks(self):
+        """Step all games whose current player has acted or timed out, once per tick.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.tick)
+            now = loop.time()
+            ready = [match for match in self.matches.values() if match.is_ready(now)]
+            if ready:
+                self._play_turns(ready)
+
+    def _play_turns(self, matches):
+        """Apply the current players' actions, or no-ops if there are none, and hand the turns to the next players.
+        The observations of all matches are built in one batch afterwards.
+        """
+        # the players that receive an observation in this tick, all players of the finished matches
+        receivers = []
+        for match in matches:
+            player_id = match.current_player
+            action = NOOP_ACTION if match.pending_action is None else match.pending_action
+            match.rewards[player_id] += match.game.take_turn(action, player_id)
+            match.pending_action = None
+            if match.game.is_done:
+                receivers.extend((match, connection.player_id) for connection in match.connections)
+            else:
+                match.current_player = (player_id + 1) % self.n_players
+                receivers.append((match, match.current_player))
+
+        observations = _sparse_observations([match.game for match, _ in receivers],
+                                            [player_id for _, player_id in receivers], self._cell_positions)
+        for (match, player_id), observation in zip(receivers, observations):
+            if match.game.is_done:
+                connection = match.connections[player_id]
+                connection.send({'type': 'end', 'observation': observation, 'reward': match.rewards[player_id],
+                                 'stats': match.game.get_episode_stats(player_id)})
+                connection.match, connection.player_id = None, None
+                self.matches.pop(match.match_id, None)
+            else:
+                self._begin_turn(match, observation)
+
+    def _begin_turn(self, match, observation):
+        player_id = match.current_player
+        match.deadline = asyncio.get_event_loop().time() + self.turn_timeout
+        match.connections[player_id].send({'type': 'turn', 'turn': match.game.n_turns, 'observation': observation,
+                                           'reward': match.rewards[player_id]})
+        match.rewards[player_id] = 0.0
+
+
+class _Connection:
+    """A connected client and the match it currently plays.
+    """
+
+    def __init__(self, writer, max_write_buffer):
+        self.writer = writer
+        self.max_write_buffer = max_write_buffer
+        self.match = None
+        self.player_id = None
+        self.is_closed = False
+
+    def send(self, message):
+        """Queue a message, messages are sent from the tick loop without waiting for the client. A client that doesn't
+        keep up with its messages is disconnected, its match continues with no-op actions for it.
+        """
+        if self.is_closed:
+            return
+        self.writer.write(json.dumps(message).encode() + b'\n')
+        if self.writer.transport.get_write_buffer_size() > self.max_write_buffer:
+            self.close()
+
+    def close(self):
+        self.is_closed = True
+        self.writer.close()
+
+
+class _Match:
+    """State of a running match.
+    """
+
+    def __init__(self, match_id, game, connections):
+        self.match_id = match_id
+        self.game = game
+        self.connections = connections
+        self.current_player = 0
+        self.pending_action = None
+        self.deadline = None
+        # rewards of each player that have not been sent yet
+        self.rewards = [0.0] * len(connections)
+
+    def is_ready(self, now):
+        """Whether the current player has acted, timed out or disconnected.
+        """
+        return self.pending_action is not None or now >= self.deadline or \
+            self.connections[self.current_player].is_closed
+
+
+def _sparse_observations(games, player_ids, cell_positions):
+    """Build the sparse observations of several games at once, see `Player.get_sparse_observation()`. The boards are
+    stacked, so that the placed pieces of all of them are found and seen from the players' perspectives with a single
+    pass of array operations.
+
+    :param games: games with boards of the same dimensions and number of players.
+    :param player_ids: the observing player of each game.
+    :param cell_positions: list of the position of each cell as list, in row-major order.
+    :return: list of observations, with lists instead of numpy arrays.
+    """
+    if not games:
+        return []
+    board = games[0].board
+    players = [game.players[player_id] for game, player_id in zip(games, player_ids)]
+    codes = np.stack([game.board.codes.reshape(-1) for game in games])
+    placed = np.flatnonzero(codes)
+    rows, cells = np.divmod(placed, board.n_cells)
+    # all boards share the perspective lookup tables
+    observed = board.all_permutations[np.asarray(player_ids)[rows], codes.reshape(-1)[placed]].tolist()
+    positions = list(map(cell_positions.__getitem__, cells.tolist()))
+    bounds = np.searchsorted(rows, np.arange(len(games) + 1)).tolist()
+    cursors = np.array([player.cursor for player in players]).tolist()
+    scalars = (np.array([(player.population, player.room) for player in players]) / board.n_cells).tolist()
+    return [{'positions': positions[start:end], 'codes': observed[start:end], 'cursor': cursor, 'scalars': scalar}
+            for start, end, cursor, scalar in zip(bounds[:-1], bounds[1:], cursors, scalars)]
+
+
+def _parse_action(action, game):
+    """Validate an action received from a client.
+
+    :return: the action as integer or as list of two integers.
+    """
+    n_moves, n_pieces = 1 + 2 * game.n_dims, len(game.name_to_id)
+    if isinstance(action, list):
+        move, piece = (int(a) for a in action)
+        if not (0 <= move < n_moves and 0 <= piece < n_pieces):
+            raise ValueError(f'invalid action {action}.')
+        return [move, piece]
+    action = int(action)
+    if not 0 <= action < n_moves * n_pieces:
+        raise ValueError(f'invalid action {action}.')
+    return action
+
+
+class MatchClient:
+    """Plays matches on a MatchServer with a policy that implements stable baselines' `predict()`, e.g. a trained model
+    or one of the scripted policies in `gym_env/policies.py`. The sparse observations received are rebuilt into the
+    'grid' or 'flat' format that the policy expects.
+    """
+
+    def __init__(self, policy, formatting='flat', deterministic=True):
+        """
+
+        :param policy: the policy that chooses the actions.
+        :param formatting: 'flat' or 'grid', the observation format of the policy.
+        :param deterministic: passed to the policy's `predict()`.
+        """
+        self.policy = policy
+        self.formatting = formatting
+        self.deterministic = deterministic
+
+    async def play(self, host, port, n_matches=1):
+        """Connect to a server and play matches one after another.
+
+        :return: list of the 'end' messages of all matches.
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        results = []
+        start = None
+        is_queued = False
+        try:
+            while len(results) < n_matches:
+                if not is_queued:
+                    writer.write(b'{"type": "join"}\n')
+                    is_queued = True
+                message = json.loads(await reader.readline())
+                if message['type'] == 'start':
+                    start = message
+                elif message['type'] == 'turn':
+                    action = self._predict(message['observation'], start)
+                    reply = {'type': 'action', 'action': action, 'turn': message['turn']}
+                    writer.write(json.dumps(reply).encode() + b'\n')
+                elif message['type'] == 'end':
+                    results.append(message)
+                    is_queued = False
+                elif message['type'] == 'error':
+                    raise RuntimeError(message['message'])
+        finally:
+            writer.close()
+        return results
+
+    def _predict(self, observation, start):
+        grid_size = tuple(start['grid_size'])
+        codes = np.zeros(grid_size, dtype=np.int64)
+        positions = np.array(observation['positions'], dtype=np.int64).reshape(-1, len(grid_size))
+        codes[tuple(positions.T)] = observation['codes']
+        n_grid = np.prod(grid_size)
+        populations, rooms = np.array(observation['scalars']) * n_grid
+        obs = build_observations(self.formatting, codes[None], np.array(observation['cursor'])[None], [populations],
+                                 [rooms], start['one_hot_dim'])
+        actions, _ = self.policy.predict(obs, deterministic=self.deterministic)
+        # an integer for discrete actions, a list for multi-discrete actions
+        return np.asarray(actions)[0].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an Expando match server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--grid-size', type=int, nargs='+', default=[12, 16])
+    parser.add_argument('--n-players', type=int, default=2)
+    parser.add_argument('--max-turns', type=int, default=200)
+    parser.add_argument('--turn-timeout', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    async def serve():
+        server = MatchServer(args.grid_size, args.n_players, args.max_turns, turn_timeout=args.turn_timeout,
+                             seed=args.seed)
+        await server.start(args.host, args.port)
+        await server.serve_forever()
+
+    asyncio.get_event_loop().run_until_complete(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import numpy as np
-from gym.spaces import MultiBinary, Box
+from gym.spaces import MultiBinary, Box, Space
 
 
 class OneHot(MultiBinary):
@@ -43,7 +43,7 @@ class OneHotBox(Box):
     """Concatenation of a OneHot and Box space.
     """
 
-    def __init__(self, one_hot, flat_box, flatten=True):
+    def __init__(self, one_hot, flat_box, flatten=True, dtype=np.float32):
         self.one_hot = one_hot
         self.flat_box = flat_box
         self.flatten = flatten
@@ -54,7 +54,7 @@ class OneHotBox(Box):
         else:
             shape = (np.prod(one_hot.n) + flat_box.shape[0],)
 
-        super().__init__(0, 1, shape)
+        super().__init__(0, 1, shape, dtype=dtype)
 
     def sample(self):
 
@@ -84,3 +84,42 @@ class OneHotBox(Box):
         contains_box = self.flat_box.contains(box_obs)
 
         return contains_one_hot and contains_box
+
+
+class SparseBoard(Space):
+    """Space of sparse board observations, i.e. dicts holding the 'positions' and 'codes' of all placed pieces, the
+    'cursor' position and normalized 'scalars', where a code is the index of a piece's one-hot encoding.
+    """
+
+    def __init__(self, grid_size, one_hot_dim, n_scalars=2):
+        """
+
+        :param grid_size: dimensions of the board.
+        :param one_hot_dim: number of possible codes, including the empty field's code 0.
+        :param n_scalars: number of scalar features.
+        """
+        self.grid_size = tuple(grid_size)
+        self.one_hot_dim = one_hot_dim
+        self.n_scalars = n_scalars
+        super().__init__()
+
+    def sample(self):
+        n_cells = np.prod(self.grid_size)
+        flat_positions = np.unique(self.np_random.randint(0, n_cells, size=self.np_random.randint(0, 64)))
+        positions = np.stack(np.unravel_index(flat_positions, self.grid_size), axis=-1)
+        return {'positions': positions,
+                'codes': self.np_random.randint(1, self.one_hot_dim, size=len(positions)),
+                'cursor': self.np_random.randint(0, self.grid_size),
+                'scalars': self.np_random.uniform(size=self.n_scalars)}
+
+    def contains(self, x):
+        positions, codes = np.asarray(x['positions']), np.asarray(x['codes'])
+        grid_size = np.array(self.grid_size)
+
+        valid_positions = positions.ndim == 2 and positions.shape[1] == len(self.grid_size) and np.all(
+            (positions >= 0) & (positions < grid_size))
+        valid_codes = codes.shape == positions.shape[:1] and np.all((codes > 0) & (codes < self.one_hot_dim))
+        valid_cursor = np.all((x['cursor'] >= 0) & (x['cursor'] < grid_size))
+        valid_scalars = np.shape(x['scalars']) == (self.n_scalars,)
+
+        return bool(valid_positions and valid_codes and valid_cursor and valid_scalars)
@@ -0,0 +1,122 @@
+"""Delta encoding of observations for cheap transport between env workers and the learner.
+
+Within a turn, at most one piece per player is placed, so instead of the full observation an env can send a small
+message of fixed length, holding only the cells that changed since the last message, the observing player's cursor
+and scalars:
+
+    [reset_flag, n_changes, cell_0, ..., cell_{P-1}, code_0, ..., code_{P-1}, cursor_0, ..., cursor_n, population, room]
+
+where P = n_players is the maximum number of changes per message, cells are flat cell indices and codes are the
+categorical codes of the placed pieces as seen by the observing player. If the reset flag is set, the board was cleared
+before the changes were made. The receiving side keeps the boards in a persistent buffer, applies the changes and
+rebuilds full observations for a whole batch of envs at once.
+"""
+import numpy as np
+from gym.spaces import Box
+
+from gym_env.game.encoding import build_observations
+
+
+class DeltaEncoder:
+    """Builds delta messages from a game, keeping track of which placed pieces have already been sent.
+    """
+
+    def __init__(self, grid_size, n_players):
+        """
+
+        :param grid_size: dimensions of the board.
+        :param n_players: number of players, i.e. the maximum number of pieces placed between two messages.
+        """
+        self.grid_size = tuple(grid_size)
+        self.max_changes = n_players
+        self.message_size = 2 + 2 * n_players + len(grid_size) + 2
+        self.observation_space = Box(0.0, np.inf, shape=(self.message_size,), dtype=np.float64)
+        self._n_sent = 0
+        self._is_reset = True
+
+    def reset(self):
+        """Mark the board as cleared, has to be called whenever the game is reset.
+        """
+        self._n_sent = 0
+        self._is_reset = True
+
+    def encode(self, game, player_id=0):
+        """Build the message holding the changes since the last message.
+
+        :param game: the game to encode, with a dense or sparse board.
+        :param player_id: id of the observing player.
+        :return: float64 numpy array of shape (message_size,)
+        """
+        board = game.board
+        new_positions = board.placed_positions[self._n_sent:]
+        n_changes = len(new_positions)
+        assert n_changes <= self.max_changes, 'more pieces were placed than can be sent with a single message.'
+
+        p = self.max_changes
+        message = np.zeros(self.message_size)
+        message[0] = self._is_reset
+        message[1] = n_changes
+        if n_changes:
+            message[2:2 + n_changes] = np.ravel_multi_index(np.array(new_positions).T, self.grid_size)
+            new_codes = np.array(board.placed_codes[self._n_sent:], dtype=np.int64)
+            message[2 + p:2 + p + n_changes] = board.permutation(player_id)[new_codes]
+
+        player = game.players[player_id]
+        message[2 + 2 * p:-2] = player.cursor
+        message[-2:] = player.population, player.room
+
+        self._n_sent += n_changes
+        self._is_reset = False
+        return message
+
+
+class DeltaDecoder:
+    """Rebuilds full observations from the delta messages of a batch of envs.
+    """
+
+    def __init__(self, n_envs, grid_size, n_players, one_hot_dim, formatting, dtype=np.float64):
+        """
+
+        :param n_envs: number of envs sending messages.
+        :param grid_size: dimensions of the board.
+        :param n_players: number of players, see `DeltaEncoder`.
+        :param one_hot_dim: size of the one-hot encodings.
+        :param formatting: 'flat' or 'grid', the format of the rebuilt observations.
+        :param dtype: dtype of the rebuilt observations.
+        """
+        self.grid_size = tuple(grid_size)
+        self.max_changes = n_players
+        self.one_hot_dim = one_hot_dim
+        self.formatting = formatting
+        self.dtype = dtype
+
+        n_dims = len(self.grid_size)
+        self.codes = np.zeros((n_envs,) + self.grid_size, dtype=np.min_scalar_type(one_hot_dim - 1))
+        self.cursors = np.zeros((n_envs, n_dims), dtype=np.int64)
+        self.populations = np.zeros(n_envs)
+        self.rooms = np.zeros(n_envs)
+
+    def decode(self, messages, env_ids=None):
+        """Apply the messages to the buffered states and rebuild the observations.
+
+        :param messages: array of shape (batch, message_size).
+        :param env_ids: indices of the envs that sent the messages, defaults to all envs in order.
+        :return: batch of observations.
+        """
+        messages = np.asarray(messages)
+        env_ids = np.arange(len(self.codes)) if env_ids is None else np.asarray(env_ids)
+        p = self.max_changes
+
+        flat_codes = self.codes.reshape(len(self.codes), -1)
+        flat_codes[env_ids[messages[:, 0] != 0]] = 0
+
+        is_change = np.arange(p) < messages[:, 1:2]
+        change_envs = np.broadcast_to(env_ids[:, None], is_change.shape)[is_change]
+        cells = messages[:, 2:2 + p][is_change].astype(np.int64)
+        flat_codes[change_envs, cells] = messages[:, 2 + p:2 + 2 * p][is_change]
+
+        self.cursors[env_ids] = messages[:, 2 + 2 * p:-2]
+        self.populations[env_ids] = messages[:, -2]
+        self.rooms[env_ids] = messages[:, -1]
+        return build_observations(self.formatting, self.codes[env_ids], self.cursors[env_ids],
+                                  self.populations[env_ids], self.rooms[env_ids], self.one_hot_dim, dtype=self.dtype)
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnvWrapper, DummyVecEnv
+from stable_baselines3.common.vec_env.util import obs_space_info
+
+from gym_env.transport import DeltaDecoder, DeltaEncoder
+
+
+class DeltaDecodingVecEnv(VecEnvWrapper):
+    """Rebuilds the full observations of vectorized Expando envs that use delta transport, i.e. were created with
+    `transport='delta'`. Only the small delta messages are sent from the env workers, the boards are kept in a
+    persistent buffer in the learner's process. Terminal observations in the info dicts are decoded as well.
+    """
+
+    def __init__(self, venv):
+        """
+
+        :param venv: vectorized Expando envs with delta transport.
+        """
+        observation_space = venv.get_attr('full_observation_space', indices=[0])[0]
+        super().__init__(venv, observation_space=observation_space)
+        self.decoder = None
+        self.update_layout()
+
+    def update_layout(self):
+        """Rebuild the decoder for the current board size and number of players of the envs, see
+        `reconfigure_vec_env()`.
+        """
+        layout = self.venv.get_attr('transport_layout', indices=[0])[0]
+        self.observation_space = self.venv.get_attr('full_observation_space', indices=[0])[0]
+        self.decoder = DeltaDecoder(self.venv.num_envs, **layout)
+
+    def reset(self):
+        return self.decoder.decode(self.venv.reset())
+
+    def step_wait(self):
+        messages, rewards, dones, infos = self.venv.step_wait()
+        # the terminal message precedes the message of the reset env
+        for i in np.flatnonzero(dones):
+            terminal_message = infos[i].get('terminal_observation')
+            if terminal_message is not None:
+                infos[i]['terminal_observation'] = self.decoder.decode(terminal_message[None], [i])[0]
+        return self.decoder.decode(messages), rewards, dones, infos
+
+
+def reconfigure_vec_env(venv, **kwargs):
+    """Reconfigure vectorized Expando envs in place, without respawning the env workers, see `Expando.reconfigure()`.
+
+    Changes of the opponents, `max_turns` or `final_reward` are applied by each env at the start of its next episode.
+    Changes of the board's size or the number of players change the shape of observations, so all envs are reset right
+    away and the observation spaces of the vectorized env and its wrappers are updated. When training, the returned
+    observations have to replace the model's last observations, i.e. `model._last_obs`.
+
+    :param venv: vectorized Expando envs, possibly wrapped.
+    :param kwargs: settings to change, see `Expando.reconfigure()`.
+    :return: the first observations after the reset if the shape of observations may have changed, None otherwise.
+    """
+    venv.env_method('reconfigure', **kwargs)
+    if 'grid_size' not in kwargs and 'n_players' not in kwargs:
+        return None
+
+    wrappers = [venv]
+    while isinstance(wrappers[-1], VecEnvWrapper):
+        wrappers.append(wrappers[-1].venv)
+    base = wrappers.pop()
+
+    # resetting the envs directly applies the settings, without passing observations of a new shape to the buffers
+    base.env_method('reset')
+    full_observation_space = base.get_attr('full_observation_space', indices=[0])[0]
+    if base.get_attr('transport', indices=[0])[0] is None:
+        observation_space = full_observation_space
+    else:
+        layout = base.get_attr('transport_layout', indices=[0])[0]
+        observation_space = DeltaEncoder(layout['grid_size'], layout['n_players']).observation_space
+    # env wrappers like Monitor keep a copy of the observation space
+    base.set_attr('observation_space', observation_space)
+    base.observation_space = observation_space
+    if isinstance(base, DummyVecEnv):
+        base.keys, shapes, dtypes = obs_space_info(observation_space)
+        base.buf_obs = OrderedDict([(k, np.zeros((base.num_envs,) + tuple(shapes[k]), dtype=dtypes[k]))
+                                    for k in base.keys])
+
+    for wrapper in reversed(wrappers):
+        if isinstance(wrapper, DeltaDecodingVecEnv):
+            wrapper.update_layout()
+        else:
+            wrapper.observation_space = wrapper.venv.observation_space
+    return venv.reset()